@@ -2,22 +2,323 @@ import os
 import cv2
 import numpy as np
 import base64
+import sys
 import time
-from flask import Flask, render_template, request, jsonify, send_file
-from scanner import DocumentScanner
-from fpdf import FPDF
+import re
+import uuid
+from flask import Flask, Response, g, render_template, request, jsonify, send_file, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+from scanner import DocumentScanner, FILTER_TYPES
+from batch import BatchProcessor
+from pdf_writer import write_pdf, stream_pdf
+from jobs import JobQueue
+from metrics import Registry, StageProfiler
+from result_cache import ResultCache, image_key
+from retention import RetentionManager
+from previews import PreviewStore
+from encoding import encoder_from_env
+from search_index import SearchIndex, PageIndexer
 
 # explicitly set folder paths
 template_dir = os.path.abspath('templates')
 static_dir = os.path.abspath('static')
 app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
-scanner = DocumentScanner()
+
+# Largest accepted request body: one upload to /process or a whole /process_batch
+# (a 12 MP JPEG is ~5 MB; base64 adds a third). Bigger requests get a 413
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", "100"))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+
+# Batch pool workers are started with spawn/forkserver (see batch.py), which imports
+# the script that started the server again (as __mp_main__); they must not run its
+# background services
+POOL_WORKER = "__mp_main__" in sys.modules
+
+# Prometheus metrics, served at /metrics (METRICS_ENABLED=0 turns all timing off)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram("scanner_stage_seconds", "Time spent in each pipeline stage.", ["stage"])
+REQUEST_SECONDS = metrics.histogram("scanner_request_seconds", "Request latency by endpoint.", ["endpoint"])
+IN_FLIGHT = metrics.gauge("scanner_requests_in_flight", "Requests currently being handled.", ["endpoint"])
+SCANS = metrics.counter("scanner_scans_total", "Processed pages by detection result and filter.", ["detected", "filter"])
+ERRORS = metrics.counter("scanner_errors_total", "Error responses by endpoint and status.", ["endpoint", "status"])
+CACHE_LOOKUPS = metrics.counter("scanner_cache_lookups_total", "Result cache lookups by outcome.", ["result"])
+
+# Detection runs on a downscaled copy (longest side in px), warping stays full size
+DETECT_MAX_SIDE = int(os.environ.get("DETECT_MAX_SIDE", "800"))
+# Fixed-mount stations: reuse warp maps while the page corners move less than this (px, 0 = off)
+LOCK_GEOMETRY_PX = float(os.environ.get("LOCK_GEOMETRY_PX", "0")) or None
+scanner = DocumentScanner(detect_max_side=DETECT_MAX_SIDE, refine_corners=True,
+                          profiler=StageProfiler(STAGE_SECONDS) if METRICS_ENABLED else None,
+                          lock_tolerance=LOCK_GEOMETRY_PX)
+
+# Live outline for the web client: small preview frames, no corner refinement
+OUTLINE_MAX_SIDE = 320
+OUTLINE_MAX_BYTES = 256 * 1024 # Preview frames are ~10-30 KB JPEGs
+outline_scanner = DocumentScanner(detect_max_side=OUTLINE_MAX_SIDE)
+
+# Output format per filter (SCAN_BW_FORMAT=png|tiff, SCAN_TONE_FORMAT=jpeg|webp, qualities)
+encoder = encoder_from_env()
+
+# Process pool for /process_batch (defaults to one worker per core)
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", "0")) or None
+batch_processor = BatchProcessor(workers=BATCH_WORKERS, detect_max_side=DETECT_MAX_SIDE, refine_corners=True,
+                                 encoder=encoder, lock_tolerance=LOCK_GEOMETRY_PX)
 
 # Ensure directories exist
 SCANS_DIR = os.path.join("static", "scans")
 OUTPUT_DIR = os.path.join("static", "output")
+# Server-side state that must not be publicly served (job database, warped pages)
+# Previews are served by /previews with long cache headers instead of /static
+DATA_DIR = "data"
+WARPED_DIR = os.path.join(DATA_DIR, "warped")
+# Warps are stored losslessly, so a filter rendered later (/refilter) starts from
+# the same pixels as the ones rendered by /process. Low compression: written once,
+# read at most a few times
+WARPED_PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+PREVIEWS_DIR = os.path.join(DATA_DIR, "previews")
 os.makedirs(SCANS_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+os.makedirs(WARPED_DIR, exist_ok=True)
+
+# PDF compiles run in the background; state lives in SQLite so any worker can report it
+COMPILE_WORKERS = int(os.environ.get("COMPILE_WORKERS", "2"))
+jobs = JobQueue(os.path.join(DATA_DIR, "jobs.db"), workers=COMPILE_WORKERS)
+
+# Processed scans keyed by a hash of the decoded frame and scanner settings (the scan
+# id). The cache holds the unfiltered warp under the scan id and each filtered output
+# under "<scan id>_<filter>". Repeated uploads reuse the saved files instead of
+# reprocessing, and /refilter starts from the stored warp.
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_MB = int(os.environ.get("CACHE_MAX_MB", "512"))
+result_cache = ResultCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_MB * 1024 * 1024)
+
+# Gallery thumbnails, written in the background after each scan is saved
+previews = PreviewStore(PREVIEWS_DIR)
+
+# Full-text search over the scans: OCR (tesseract, if installed) runs in the background
+search_index = SearchIndex(os.path.join(DATA_DIR, "search_index.jsonl"), compact=not POOL_WORKER)
+indexer = PageIndexer(search_index)
+
+# Scans and PDFs are deleted after a TTL or once over quota by a background sweeper.
+# Clients tag their uploads with an X-Session-Id header so /cleanup can drop a session
+# (and /search only shows a session its own pages); the tags are kept across restarts.
+RETENTION_TTL_HOURS = float(os.environ.get("RETENTION_TTL_HOURS", "24"))
+RETENTION_MAX_MB = int(os.environ.get("RETENTION_MAX_MB", "2048"))
+RETENTION_INTERVAL = int(os.environ.get("RETENTION_INTERVAL", "300"))
+retention = RetentionManager([SCANS_DIR, OUTPUT_DIR, WARPED_DIR] + [previews.size_dir(size) for size in previews.sizes],
+                             ttl=RETENTION_TTL_HOURS * 3600, max_bytes=RETENTION_MAX_MB * 1024 * 1024,
+                             interval=RETENTION_INTERVAL, sessions_path=os.path.join(DATA_DIR, "sessions.jsonl"),
+                             compact=not POOL_WORKER)
+
+def drop_previews(path):
+    # A scan's previews go with it
+    for preview in previews.discard(path):
+        retention.forget(preview)
+
+def drop_evicted(path):
+    # Only the warped intermediates are the cache's own; scans and PDFs were given
+    # to clients and stay until retention deletes them
+    if os.path.dirname(path) != WARPED_DIR:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    retention.forget(path)
+
+def drop_from_index(path):
+    if os.path.dirname(path) == SCANS_DIR:
+        search_index.remove(os.path.basename(path))
+
+retention.on_delete.append(result_cache.discard_path)
+retention.on_delete.append(drop_previews)
+retention.on_delete.append(drop_from_index)
+result_cache.on_evict = drop_evicted
+if not POOL_WORKER:
+    retention.start()
+
+SCAN_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+# Stored warps held in memory at once by a multi-page /refilter
+REFILTER_CHUNK = 8
+
+# Content types accepted as a raw image body by /process
+RAW_IMAGE_TYPES = ("image/jpeg", "image/png", "application/octet-stream")
+
+def read_raw_image():
+    """
+    Decodes a raw image body. The bytes are read from the request stream straight
+    into the buffer handed to cv2.imdecode, without intermediate copies.
+    Raises RequestEntityTooLarge for bodies over MAX_CONTENT_LENGTH.
+    """
+    length = request.content_length
+    # Checked before the buffer is allocated from the client's Content-Length
+    if length and length > app.config["MAX_CONTENT_LENGTH"]:
+        raise RequestEntityTooLarge()
+    stream = request.stream
+    if length and hasattr(stream, "readinto"):
+        buf = np.empty(length, np.uint8)
+        view = memoryview(buf)
+        received = 0
+        while received < length:
+            n = stream.readinto(view[received:])
+            if not n:
+                break
+            received += n
+        buf = buf[:received]
+    else:
+        # Chunked upload (no Content-Length): let werkzeug collect the body
+        buf = np.frombuffer(request.get_data(cache=False), np.uint8)
+
+    if buf.size == 0:
+        return None
+    with scanner.stage("decode"):
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+def detect_outline(data):
+    """
+    Document quad in a small encoded preview frame, as fractions of the frame
+    size (top-left, top-right, bottom-right, bottom-left). None if the frame
+    can't be decoded. Safe to call from any thread.
+    """
+    frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        return None
+
+    contour, _ = outline_scanner.detect_document(frame)
+    if contour is None:
+        return {"success": True, "detected": False, "quad": None}
+    height, width = frame.shape[:2]
+    rect = outline_scanner.order_points(contour.reshape(4, 2).astype("float32"))
+    quad = [[round(float(x) / width, 4), round(float(y) / height, 4)] for x, y in rect]
+    return {"success": True, "detected": True, "quad": quad}
+
+def session_id():
+    return request.headers.get("X-Session-Id")
+
+def normalize_filter(filter_type):
+    # Unknown filters leave the page unfiltered, as apply_filter does
+    return filter_type if filter_type in FILTER_TYPES else "original"
+
+def count_scan(detected, filter_type):
+    if METRICS_ENABLED:
+        SCANS.inc(detected=str(bool(detected)).lower(), filter=normalize_filter(filter_type))
+
+def load_warped(scan_id):
+    """
+    Returns the stored unfiltered page and detection flag for a scan, or None.
+    """
+    entry = result_cache.get(scan_id)
+    if entry is None:
+        return None
+    page = cv2.imread(entry.path, cv2.IMREAD_COLOR)
+    if page is None:
+        return None
+    return page, entry.info["detected"]
+
+def warped_path(scan_id):
+    return os.path.join(WARPED_DIR, f"{scan_id}.png")
+
+def store_warped(scan_id, page, detected):
+    # Only used as the input of later filters (see WARPED_PNG_PARAMS)
+    path = warped_path(scan_id)
+    with scanner.stage("encode"):
+        cv2.imwrite(path, page, WARPED_PNG_PARAMS)
+    record_warped(scan_id, detected, session_id())
+
+def record_warped(scan_id, detected, session=None):
+    path = warped_path(scan_id)
+    result_cache.put(scan_id, path, {"detected": detected})
+    retention.track(path, session)
+
+def missing_variants(scan_id, filter_type):
+    # The filter asked for first, then the scan's other filters not rendered yet
+    return [filter_type] + [other for other in FILTER_TYPES
+                            if other != filter_type and result_cache.get(f"{scan_id}_{other}") is None]
+
+def save_filtered(scan_id, filter_type, page, detected):
+    """
+    Renders filter_type and the scan's other missing filters from one grayscale
+    pass and saves them, so switching the page's filter later is a cache hit.
+    """
+    variants = scanner.filter_variants(page, missing_variants(scan_id, filter_type))
+    for name, final_image in variants.items():
+        path = os.path.join(SCANS_DIR, scan_filename(scan_id, name))
+        with scanner.stage("encode"):
+            encoder.save(final_image, path, name)
+        if name == filter_type:
+            record_filtered(scan_id, name, detected, final_image)
+        else:
+            record_variant(scan_id, name, detected, session_id())
+
+def record_filtered(scan_id, filter_type, detected, image=None):
+    # Cache, previews and search for a scan written by save_filtered (or a worker process)
+    path = os.path.join(SCANS_DIR, scan_filename(scan_id, filter_type))
+    result_cache.put(f"{scan_id}_{filter_type}", path, {"detected": detected})
+    queue_previews(path, image)
+    indexer.submit(os.path.basename(path), path)
+
+def record_variant(scan_id, filter_type, detected, session=None):
+    # A filter rendered ahead of time: kept with the session, but previews and OCR
+    # wait until it is actually shown (see scan_result)
+    path = os.path.join(SCANS_DIR, scan_filename(scan_id, filter_type))
+    result_cache.put(f"{scan_id}_{filter_type}", path, {"detected": detected, "prerendered": True})
+    retention.track(path, session)
+
+def queue_previews(path, image=None):
+    future = previews.submit(path, image)
+    future.add_done_callback(track_previews)
+
+def track_previews(future):
+    if future.exception() is None:
+        for path in future.result().values():
+            retention.track(path)
+
+def scan_filename(scan_id, filter_type):
+    return f"scan_{scan_id}_{filter_type}{encoder.extension(filter_type)}"
+
+def scan_response(scan_id, filter_type, detected, cached):
+    return jsonify(scan_result(scan_id, filter_type, detected, cached, session_id()))
+
+def scan_result(scan_id, filter_type, detected, cached, session=None):
+    filename = scan_filename(scan_id, filter_type)
+    retention.track(os.path.join(SCANS_DIR, filename), session)
+
+    # First time a pre-rendered filter is shown: now it needs previews and OCR
+    entry = result_cache.get(f"{scan_id}_{filter_type}")
+    if entry is not None and entry.info.get("prerendered"):
+        record_filtered(scan_id, filter_type, detected)
+
+    # Return info
+    return {
+        "success": True,
+        "detected": detected,
+        "cached": cached,
+        "scan_id": scan_id,
+        "filter": filter_type,
+        "url": f"/static/scans/{filename}",
+        "thumb_url": f"/previews/{min(previews.sizes)}/{filename}",
+        "filename": filename
+    }
+
+@app.before_request
+def start_request_metrics():
+    if METRICS_ENABLED:
+        g.metrics_endpoint = request.endpoint or "unknown"
+        g.metrics_start = time.perf_counter()
+        IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_error_metrics(response):
+    if METRICS_ENABLED and response.status_code >= 400:
+        ERRORS.inc(endpoint=request.endpoint or "unknown", status=str(response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    if METRICS_ENABLED and "metrics_start" in g:
+        IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.metrics_start, endpoint=g.metrics_endpoint)
 
 @app.route("/")
 def index():
@@ -26,89 +327,339 @@ def index():
 @app.route("/process", methods=["POST"])
 def process_image():
     try:
-        # Get image from POST request (base64)
-        data = request.json.get("image")
-        filter_type = request.json.get("filter", "bw") # bw, gray, original
-        
-        if not data:
-            return jsonify({"error": "No image data provided"}), 400
-
-        # Decode base64
-        header, encoded = data.split(",", 1)
-        nparr = np.frombuffer(base64.b64decode(encoded), np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        # Detect Document
-        doc_contour, _ = scanner.detect_document(frame)
-        
-        # Warp or use original
-        if doc_contour is not None:
-            processed_frame = scanner.get_perspective_transform(frame, doc_contour.reshape(4, 2))
-            detected = True
+        if request.mimetype in RAW_IMAGE_TYPES:
+            # Raw JPEG/PNG body, filter in the query string
+            filter_type = request.args.get("filter", "bw") # bw, gray, original
+            if request.content_length == 0:
+                return jsonify({"error": "No image data provided"}), 400
+            frame = read_raw_image()
         else:
-            processed_frame = frame
-            detected = False
+            # Get image from POST request (base64)
+            data = request.json.get("image")
+            filter_type = request.json.get("filter", "bw") # bw, gray, original
 
-        # Apply Filter
-        final_image = scanner.apply_filter(processed_frame, filter_type=filter_type)
+            if not data:
+                return jsonify({"error": "No image data provided"}), 400
 
-        # Save to file
-        timestamp = int(time.time() * 1000)
-        filename = f"scan_{timestamp}.jpg"
-        filepath = os.path.join(SCANS_DIR, filename)
-        cv2.imwrite(filepath, final_image)
+            # Decode base64
+            with scanner.stage("decode"):
+                header, encoded = data.split(",", 1)
+                nparr = np.frombuffer(base64.b64decode(encoded), np.uint8)
+                frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
-        # Return info
-        return jsonify({
-            "success": True,
-            "detected": detected,
-            "url": f"/static/scans/{filename}",
-            "filename": filename
-        })
+        if frame is None:
+            return jsonify({"error": "Could not decode image"}), 400
+
+        filter_type = normalize_filter(filter_type)
+
+        # Same frame and settings -> same scan id; the id plus the filter names the output
+        with scanner.stage("hash"):
+            scan_id = image_key(frame, sorted(scanner.settings().items()))
+
+        cached = result_cache.get(f"{scan_id}_{filter_type}")
+        if METRICS_ENABLED:
+            CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+        if cached:
+            detected = cached.info["detected"]
+        else:
+            # Reuse the stored warp if this frame was already processed with another filter
+            stored = load_warped(scan_id)
+            if stored is not None:
+                page, detected = stored
+            else:
+                # Detect and warp
+                page, detected = scanner.warp_document(frame)
+                store_warped(scan_id, page, detected)
+            save_filtered(scan_id, filter_type, page, detected)
+            count_scan(detected, filter_type)
 
+        return scan_response(scan_id, filter_type, detected, cached is not None)
+
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Upload larger than {MAX_UPLOAD_MB} MB"}), 413
     except Exception as e:
         print(f"Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route("/detect", methods=["POST"])
+def detect():
+    """
+    Live outline for one small preview frame (raw JPEG body). The async server
+    also offers this as a WebSocket (/ws/outline), which the client prefers.
+    """
+    if (request.content_length or 0) > OUTLINE_MAX_BYTES:
+        return jsonify({"error": "Preview frame too large"}), 413
+    data = request.get_data(cache=False)
+    if not data:
+        return jsonify({"error": "No image data provided"}), 400
+
+    result = detect_outline(data)
+    if result is None:
+        return jsonify({"error": "Could not decode image"}), 400
+    return jsonify(result)
+
+@app.route("/refilter", methods=["POST"])
+def refilter():
+    """
+    Re-applies a filter to a page from /process using the stored warp, so no
+    upload, decode or detection is needed. With scan_ids instead of scan_id, the
+    filter is applied to several pages at once ("apply to all pages").
+    """
+    try:
+        filter_type = normalize_filter(request.json.get("filter", "bw"))
+        if "scan_ids" in request.json:
+            scan_ids = request.json["scan_ids"]
+            if not isinstance(scan_ids, list) or not all(SCAN_ID_PATTERN.fullmatch(str(s)) for s in scan_ids):
+                return jsonify({"error": "Invalid scan id"}), 400
+            return jsonify({"success": True, "results": refilter_pages(scan_ids, filter_type)})
+
+        scan_id = request.json.get("scan_id", "")
+        if not SCAN_ID_PATTERN.fullmatch(scan_id):
+            return jsonify({"error": "Invalid scan id"}), 400
+
+        cached = result_cache.get(f"{scan_id}_{filter_type}")
+        if cached:
+            detected = cached.info["detected"]
+        else:
+            stored = load_warped(scan_id)
+            if stored is None:
+                return jsonify({"error": "Page is no longer available, please scan it again"}), 404
+            page, detected = stored
+            save_filtered(scan_id, filter_type, page, detected)
+
+        return scan_response(scan_id, filter_type, detected, cached is not None)
+
+    except Exception as e:
+        print(f"Refilter Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+def refilter_pages(scan_ids, filter_type):
+    """
+    /refilter for a list of pages. Cached ones are answered as they are; the rest
+    are filtered REFILTER_CHUNK at a time from their stored warps (see
+    apply_filter_batch). Returns one result per scan id, in order, with an error
+    for pages that expired.
+    """
+    session = session_id()
+    results = {}
+    pending = []
+    for scan_id in dict.fromkeys(scan_ids):
+        cached = result_cache.get(f"{scan_id}_{filter_type}")
+        if cached:
+            results[scan_id] = scan_result(scan_id, filter_type, cached.info["detected"], True, session)
+        else:
+            pending.append(scan_id)
+
+    for start in range(0, len(pending), REFILTER_CHUNK):
+        chunk = []
+        for scan_id in pending[start:start + REFILTER_CHUNK]:
+            stored = load_warped(scan_id)
+            if stored is None:
+                results[scan_id] = {"scan_id": scan_id, "error": "Page is no longer available, please scan it again"}
+            else:
+                chunk.append((scan_id, *stored))
+
+        pages = scanner.apply_filter_batch([page for _, page, _ in chunk], filter_type)
+        for (scan_id, _, detected), final_image in zip(chunk, pages):
+            path = os.path.join(SCANS_DIR, scan_filename(scan_id, filter_type))
+            with scanner.stage("encode"):
+                encoder.save(final_image, path, filter_type)
+            record_filtered(scan_id, filter_type, detected, final_image)
+            results[scan_id] = scan_result(scan_id, filter_type, detected, False, session)
+
+    return [results[scan_id] for scan_id in scan_ids]
+
+@app.route("/process_batch", methods=["POST"])
+def process_batch():
+    try:
+        # Multipart upload: one raw JPEG/PNG part per page, in page order
+        files = request.files.getlist("images")
+        filter_type = request.form.get("filter", "bw")
+
+        if not files:
+            return jsonify({"error": "No images provided"}), 400
+
+        # Unique per batch: concurrent batches (threaded workers, ASGI) must not
+        # write over each other's pages
+        batch_id = uuid.uuid4().hex
+        extension = encoder.extension(filter_type)
+        filenames = [f"scan_{batch_id}_{i:03d}{extension}" for i in range(len(files))]
+        pages = [f.read() for f in files]
+
+        outcomes = batch_processor.process(
+            pages, filter_type, [os.path.join(SCANS_DIR, name) for name in filenames])
+
+        results = []
+        for filename, outcome in zip(filenames, outcomes):
+            if outcome.get("success"):
+                count_scan(outcome["detected"], filter_type)
+                retention.track(os.path.join(SCANS_DIR, filename), session_id())
+                queue_previews(os.path.join(SCANS_DIR, filename))
+                indexer.submit(filename, os.path.join(SCANS_DIR, filename))
+                outcome["url"] = f"/static/scans/{filename}"
+                outcome["thumb_url"] = f"/previews/{min(previews.sizes)}/{filename}"
+                outcome["filename"] = filename
+            results.append(outcome)
+
+        return jsonify({"success": True, "results": results})
+
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Upload larger than {MAX_UPLOAD_MB} MB"}), 413
+    except Exception as e:
+        print(f"Batch Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route("/compile", methods=["POST"])
 def compile_pdf():
     try:
-        filenames = request.json.get("filenames", [])
-        if not filenames:
+        paths, missing = compile_paths(request.json.get("filenames", []))
+        if missing:
+            return jsonify({"error": f"{len(missing)} page(s) no longer exist", "missing": missing}), 410
+        if not paths:
             return jsonify({"error": "No files to compile"}), 400
 
-        pdf = FPDF()
-        for fname in filenames:
-            path = os.path.join(SCANS_DIR, fname)
-            if os.path.exists(path):
-                pdf.add_page()
-                # A4 size 210x297mm
-                pdf.image(path, x=0, y=0, w=210)
-        
-        timestamp = int(time.time())
-        output_filename = f"Compiled_Doc_{timestamp}.pdf"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
-        
-        pdf.output(output_path)
+        output_filename = pdf_filename()
+
+        if request.json.get("stream"):
+            # Send pages to the client as they are written
+            return Response(stream_with_context(stream_pdf(paths)), mimetype="application/pdf",
+                            headers={"Content-Disposition": f"attachment; filename={output_filename}"})
+
+        # Build in the background, the client polls /jobs/<id>
+        job_id = jobs.submit(build_pdf, len(paths), paths, output_filename, session_id())
 
         return jsonify({
             "success": True,
-            "download_url": f"/download_pdf/{output_filename}"
-        })
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}"
+        }), 202
 
     except Exception as e:
         print(f"Compile Error: {e}")
         return jsonify({"error": str(e)}), 500
 
+def compile_paths(filenames):
+    """
+    Scan paths in the requested order (names only, no directories), and the
+    requested names whose files no longer exist.
+    """
+    paths = [os.path.join(SCANS_DIR, os.path.basename(fname)) for fname in filenames]
+    missing = [os.path.basename(path) for path in paths if not os.path.exists(path)]
+    return paths, missing
+
+def pdf_filename():
+    # Random suffix: compiles started in the same millisecond get their own file
+    timestamp = int(time.time() * 1000)
+    return f"Compiled_Doc_{timestamp}_{uuid.uuid4().hex[:8]}.pdf"
+
+def build_pdf(progress, paths, output_filename, session=None):
+    """
+    Compile job: pages are appended to the file one at a time (A4, fit to width).
+    The file is renamed into place when complete so it is never served half written.
+    """
+    output_path = os.path.join(OUTPUT_DIR, output_filename)
+    partial_path = output_path + ".part"
+    try:
+        write_pdf(paths, partial_path, progress=progress)
+    except Exception:
+        # Nothing tracks the partial file, so it would stay forever
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, output_path)
+    retention.track(output_path, session)
+    return {"download_url": f"/download_pdf/{output_filename}"}
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    response = {
+        "success": True,
+        "status": job["status"], # queued, running, done, error
+        "done": job["done"],
+        "total": job["total"]
+    }
+    if job["status"] == "done":
+        response["download_url"] = job["result"]["download_url"]
+    elif job["status"] == "error":
+        response["error"] = job["error"]
+    return jsonify(response)
+
 @app.route("/download_pdf/<filename>")
 def download_pdf(filename):
     return send_file(os.path.join(OUTPUT_DIR, filename), as_attachment=True)
 
+@app.route("/search")
+def search():
+    """
+    Scans of the caller's session (X-Session-Id) whose text matches q, by word
+    prefix or substring.
+    """
+    session = session_id()
+    query = request.args.get("q", "")
+    if not session:
+        return jsonify({"error": "Missing X-Session-Id header"}), 400
+
+    results = []
+    for filename in sorted(search_index.search(query)):
+        path = os.path.join(SCANS_DIR, filename)
+        if session in retention.sessions(path):
+            results.append({
+                "filename": filename,
+                "url": f"/static/scans/{filename}",
+                "thumb_url": f"/previews/{min(previews.sizes)}/{filename}"
+            })
+
+    return jsonify({
+        "success": True,
+        "query": query,
+        "results": results,
+        "indexing": indexer.pending(), # Pages not searchable yet
+        "enabled": indexer.enabled
+    })
+
+@app.route("/previews/<int:size>/<filename>")
+def preview(size, filename):
+    if size not in previews.sizes or filename != os.path.basename(filename):
+        return jsonify({"error": "Unknown preview"}), 404
+
+    path = previews.get(os.path.join(SCANS_DIR, filename), size)
+    if path is None:
+        return jsonify({"error": "Unknown preview"}), 404
+
+    # Scan names are unique per content, so a preview never changes once written
+    response = send_file(path, mimetype="image/jpeg", max_age=365 * 24 * 3600)
+    response.cache_control.immutable = True
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    # Per worker process; stages timed inside the batch pool are not included
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/cleanup", methods=["POST"])
 def cleanup():
-    # Optional: Clear temp files
-    # For now, we won't delete automatically to allow history, but could add later
-    return jsonify({"success": True})
+    try:
+        # With a session: delete that session's scans and PDFs. Without: run a sweep now.
+        body = request.get_json(silent=True) or {}
+        session = body.get("session") or session_id()
+        if session:
+            deleted, reclaimed = retention.delete_session(session)
+        else:
+            deleted, reclaimed = retention.sweep()
+
+        return jsonify({
+            "success": True,
+            "deleted": deleted,
+            "bytes_reclaimed": reclaimed
+        })
+
+    except Exception as e:
+        print(f"Cleanup Error: {e}")
+        return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
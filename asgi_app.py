@@ -0,0 +1,249 @@
+"""
+Async serving mode for the web app: python asgi_app.py (or uvicorn asgi_app:app).
+
+Uploads and downloads are handled on an event loop, so a slow mobile upload only
+costs a pending read instead of a whole worker. Decoding, detection, filtering
+and encoding run in the batch process pool (see batch.py); when every slot is
+taken, /process and /process_batch answer 429 with Retry-After instead of
+queueing without bound.
+
+/process, /compile and /download_pdf are served here, plus /ws/outline: a
+WebSocket taking small preview frames (binary JPEG messages) and answering each
+with the detected quad as JSON (see app.detect_outline), for the live overlay
+and auto-capture. All other routes (the
+page, /refilter, /jobs, /previews, ...) are the Flask app's, mounted behind
+them, so both share one result cache, retention index and job queue.
+"""
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+import app as flask_app
+from batch import key_upload, scan_upload
+from pdf_writer import stream_pdf
+
+# CPU jobs allowed at once (running or waiting for a pool worker); more get a 429
+MAX_PENDING = int(os.environ.get("ASGI_MAX_PENDING", "0")) or 2 * flask_app.batch_processor.workers
+RETRY_AFTER = "1" # Seconds, for clients told to back off
+# Largest accepted upload, the same MAX_UPLOAD_MB as the Flask routes (see app.py)
+MAX_UPLOAD_BYTES = flask_app.MAX_UPLOAD_MB * 1024 * 1024
+
+slots = None # asyncio.Semaphore, created on the event loop
+flask_mount = WSGIMiddleware(flask_app.app)
+
+
+def error(message, status, endpoint):
+    if flask_app.METRICS_ENABLED:
+        flask_app.ERRORS.inc(endpoint=endpoint, status=str(status))
+    headers = {"Retry-After": RETRY_AFTER} if status == 429 else None
+    return JSONResponse({"error": message}, status_code=status, headers=headers)
+
+
+async def run_cpu(func, *args):
+    # Pool shared with /process_batch; the loop only awaits the result
+    pool = flask_app.batch_processor.get_pool()
+    return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def read_body(request):
+    """
+    Reads the request body, raising UploadTooLarge as soon as it passes
+    MAX_UPLOAD_BYTES (also for chunked uploads, which have no Content-Length).
+    """
+    if int(request.headers.get("content-length") or 0) > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge()
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadTooLarge()
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def read_upload(request):
+    """
+    Returns (image data, filter): raw bytes for an image body, the base64 data URL
+    string for JSON. Data is None if missing.
+    """
+    body = await read_body(request)
+    if request.headers.get("content-type", "").split(";")[0] in flask_app.RAW_IMAGE_TYPES:
+        return body or None, request.query_params.get("filter", "bw")
+
+    body = json.loads(body)
+    return body.get("image") or None, body.get("filter", "bw")
+
+
+async def process_image(request):
+    try:
+        # Backpressure: refuse before reading the body instead of piling uploads up
+        # in memory. Checked again once it's read, as the slots may have filled up
+        if slots.locked():
+            return error("Server busy, try again shortly", 429, "process_image")
+
+        data, filter_type = await read_upload(request)
+        if not data:
+            return error("No image data provided", 400, "process_image")
+
+        if slots.locked():
+            return error("Server busy, try again shortly", 429, "process_image")
+
+        async with slots:
+            return await scan(request, data, flask_app.normalize_filter(filter_type))
+
+    except UploadTooLarge:
+        return error(f"Upload larger than {flask_app.MAX_UPLOAD_MB} MB", 413, "process_image")
+    except Exception as e:
+        print(f"Error: {e}")
+        return error(str(e), 500, "process_image")
+
+
+async def scan(request, data, filter_type):
+    # Same steps and cache as the Flask /process. The id needs the decoded pixels,
+    # so a miss decodes twice; hits (retries, other filters) skip all other work.
+    scan_id = await run_cpu(key_upload, data)
+    if scan_id is None:
+        return error("Could not decode image", 400, "process_image")
+
+    session = request.headers.get("X-Session-Id")
+    cached = flask_app.result_cache.get(f"{scan_id}_{filter_type}")
+    if flask_app.METRICS_ENABLED:
+        flask_app.CACHE_LOOKUPS.inc(result="hit" if cached else "miss")
+    if cached:
+        detected = cached.info["detected"]
+    else:
+        # Reuse the stored warp if this frame was already processed with another filter;
+        # the other filters are rendered too (see app.save_filtered)
+        stored = flask_app.result_cache.get(scan_id)
+        variants = flask_app.missing_variants(scan_id, filter_type)
+        output_paths = {name: os.path.join(flask_app.SCANS_DIR, flask_app.scan_filename(scan_id, name))
+                        for name in variants}
+        result = await run_cpu(scan_upload, data, output_paths, flask_app.warped_path(scan_id),
+                               flask_app.WARPED_PNG_PARAMS, stored.info["detected"] if stored else None)
+        detected = result["detected"]
+        if result["warped"]:
+            flask_app.record_warped(scan_id, detected, session)
+        flask_app.record_filtered(scan_id, filter_type, detected)
+        for name in variants[1:]:
+            flask_app.record_variant(scan_id, name, detected, session)
+        flask_app.count_scan(detected, filter_type)
+
+    return JSONResponse(flask_app.scan_result(scan_id, filter_type, detected, cached is not None, session))
+
+
+class SlotBound:
+    """
+    Runs an ASGI app (the Flask mount) while holding one CPU slot, or answers 429
+    if none is free. Used for /process_batch, which is Flask's: the whole batch
+    holds a single slot while its pages are spread over the pool.
+    """
+    def __init__(self, app, endpoint):
+        self.app = app
+        self.endpoint = endpoint
+
+    async def __call__(self, scope, receive, send):
+        if slots.locked():
+            response = error("Server busy, try again shortly", 429, self.endpoint)
+            await response(scope, receive, send)
+            return
+        async with slots:
+            await self.app(scope, receive, send)
+
+
+async def compile_pdf(request):
+    try:
+        body = await request.json()
+        paths, missing = flask_app.compile_paths(body.get("filenames", []))
+        if missing:
+            if flask_app.METRICS_ENABLED:
+                flask_app.ERRORS.inc(endpoint="compile_pdf", status="410")
+            return JSONResponse({"error": f"{len(missing)} page(s) no longer exist", "missing": missing},
+                                status_code=410)
+        if not paths:
+            return error("No files to compile", 400, "compile_pdf")
+
+        output_filename = flask_app.pdf_filename()
+
+        if body.get("stream"):
+            # Pages are written on a thread and sent as they come
+            return StreamingResponse(iterate_in_threadpool(stream_pdf(paths)), media_type="application/pdf",
+                                     headers={"Content-Disposition": f"attachment; filename={output_filename}"})
+
+        # Build in the background, the client polls /jobs/<id> (served by Flask)
+        job_id = flask_app.jobs.submit(flask_app.build_pdf, len(paths), paths, output_filename,
+                                       request.headers.get("X-Session-Id"))
+
+        return JSONResponse({
+            "success": True,
+            "job_id": job_id,
+            "status_url": f"/jobs/{job_id}"
+        }, status_code=202)
+
+    except Exception as e:
+        print(f"Compile Error: {e}")
+        return error(str(e), 500, "compile_pdf")
+
+
+async def download_pdf(request):
+    filename = request.path_params["filename"]
+    path = os.path.join(flask_app.OUTPUT_DIR, filename)
+    if filename != os.path.basename(filename) or not os.path.isfile(path):
+        return error("Unknown file", 404, "download_pdf")
+    return FileResponse(path, filename=filename)
+
+
+async def outline_socket(websocket):
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    while True:
+        # The client waits for each answer before sending the next frame
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+        data = message.get("bytes")
+        if not data:
+            await websocket.send_json({"error": "Expected a binary JPEG frame"})
+        elif len(data) > flask_app.OUTLINE_MAX_BYTES:
+            await websocket.send_json({"error": "Preview frame too large"})
+        else:
+            # A few ms of OpenCV on a small frame: a thread is enough, the process
+            # pool slots stay free for full resolution captures
+            result = await loop.run_in_executor(None, flask_app.detect_outline, data)
+            try:
+                await websocket.send_json(result or {"error": "Could not decode image"})
+            except WebSocketDisconnect:
+                return
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global slots
+    slots = asyncio.Semaphore(MAX_PENDING)
+    yield
+    flask_app.batch_processor.shutdown()
+
+
+app = Starlette(routes=[
+    Route("/process", process_image, methods=["POST"]),
+    Route("/process_batch", SlotBound(flask_mount, "process_batch"), methods=["POST"]),
+    Route("/compile", compile_pdf, methods=["POST"]),
+    Route("/download_pdf/{filename}", download_pdf),
+    WebSocketRoute("/ws/outline", outline_socket),
+    Mount("/", app=flask_mount),
+], lifespan=lifespan)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.environ.get("HOST", "127.0.0.1"), port=int(os.environ.get("PORT", "5000")))
@@ -0,0 +1,126 @@
+import base64
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from scanner import DocumentScanner
+from encoding import ScanEncoder
+from result_cache import image_key
+
+# Workers are started from a clean process: forking the server, which already runs
+# threads and OpenCV's thread pool, can leave the children deadlocked
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# One scanner per worker process, created by the pool initializer
+_scanner = None
+_encoder = None
+
+def init_worker(detect_max_side, refine_corners, encoder, lock_tolerance=None):
+    global _scanner, _encoder
+    _scanner = DocumentScanner(detect_max_side=detect_max_side, refine_corners=refine_corners,
+                               lock_tolerance=lock_tolerance)
+    _encoder = encoder
+    # The pool already uses every core, so keep OpenCV single threaded per worker
+    cv2.setNumThreads(1)
+
+def process_page(data, filter_type, output_path):
+    """
+    Runs detect -> warp -> filter on one encoded image and saves the result.
+    Errors are returned instead of raised so one bad page doesn't fail the batch.
+    """
+    try:
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return {"error": "Could not decode image"}
+
+        final_image, detected = _scanner.scan(frame, filter_type=filter_type)
+        _encoder.save(final_image, output_path, filter_type)
+        return {"success": True, "detected": detected}
+    except Exception as e:
+        return {"error": str(e)}
+
+def decode_upload(data):
+    """
+    Decodes an uploaded image: raw JPEG/PNG bytes or a base64 data URL string.
+    Returns None if it isn't a readable image.
+    """
+    if isinstance(data, str):
+        header, encoded = data.split(",", 1)
+        data = base64.b64decode(encoded)
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def key_upload(data):
+    """
+    Scan id of an upload (see /process), or None if it can't be decoded.
+    """
+    frame = decode_upload(data)
+    if frame is None:
+        return None
+    return image_key(frame, sorted(_scanner.settings().items()))
+
+def scan_upload(data, output_paths, warped_path, warped_params, detected=None):
+    """
+    The CPU part of /process for one upload: detect and warp (unless warped_path
+    already holds the page, then detected must be given; if the file is gone the
+    upload is warped again), then render and save each filter of output_paths
+    ({filter: path}) from one grayscale pass.
+    warped_params: cv2.imwrite parameters for the stored warp.
+    Returns {"detected", "warped"} where warped tells whether warped_path was written.
+    """
+    page = None
+    if detected is not None:
+        page = cv2.imread(warped_path, cv2.IMREAD_COLOR)
+    # No stored warp, or it was deleted (retention) since the cache lookup
+    warped = page is None
+    if warped:
+        page, detected = _scanner.warp_document(decode_upload(data))
+        cv2.imwrite(warped_path, page, warped_params)
+
+    for filter_type, final_image in _scanner.filter_variants(page, list(output_paths)).items():
+        _encoder.save(final_image, output_paths[filter_type], filter_type)
+    return {"detected": detected, "warped": warped}
+
+
+class BatchProcessor:
+    """
+    Fans pages out over a process pool. The pool is started on first use so that
+    importing the app (and gunicorn forking it) stays cheap.
+    """
+    def __init__(self, workers=None, detect_max_side=None, refine_corners=False, encoder=None, lock_tolerance=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.detect_max_side = detect_max_side
+        self.refine_corners = refine_corners
+        self.lock_tolerance = lock_tolerance
+        self.encoder = encoder or ScanEncoder()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context(START_METHOD)
+                if START_METHOD == "forkserver":
+                    # The fork server only needs this module, not the server's main script
+                    context.set_forkserver_preload(["batch"])
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=init_worker,
+                    initargs=(self.detect_max_side, self.refine_corners, self.encoder, self.lock_tolerance))
+            return self._pool
+
+    def process(self, pages, filter_type, output_paths):
+        """
+        Processes encoded pages in parallel. Results come back in input order.
+        Output paths should use the encoder's extension for the filter.
+        """
+        pool = self.get_pool()
+        return list(pool.map(process_page, pages, [filter_type] * len(pages), output_paths))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,321 @@
+"""
+Benchmark for the scanner pipeline on synthetic document photos.
+
+Every sample is a generated page (text-like lines) warped into a cluttered
+background with a random perspective, a lighting gradient and sensor noise, so
+the true corners are known. Each pipeline stage is timed on its own and the
+results are written as JSON so runs can be compared:
+
+    python benchmark.py --resolutions vga,fhd --samples 30 --output before.json
+    python benchmark.py --resolutions vga,fhd --samples 30 --output after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from scanner import DocumentScanner
+
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+STAGES = ["decode", "gray", "resize", "blur", "canny", "contours", "approx", "refine", "warp", "filter", "encode"]
+
+# A detection counts as correct if the mean corner error is below this fraction of the diagonal
+CORRECT_THRESHOLD = 0.02
+
+
+def make_page(rng, width=850, height=1100):
+    """
+    A white page with dark text-like lines and the odd block (figure/heading).
+    """
+    page = np.full((height, width, 3), 245, np.uint8)
+    y = 80
+    while y < height - 80:
+        if rng.random() < 0.08:
+            block_h = int(rng.integers(60, 160))
+            cv2.rectangle(page, (70, y), (width - 70, min(y + block_h, height - 80)), (90, 90, 90), -1)
+            y += block_h + 30
+            continue
+        x = 70
+        line_end = width - 70 - int(rng.integers(0, 200))
+        while x < line_end:
+            word = int(rng.integers(15, 70))
+            cv2.rectangle(page, (x, y), (min(x + word, line_end), y + 12), (40, 40, 40), -1)
+            x += word + 12
+        y += 28
+    return page
+
+
+def make_background(rng, width, height):
+    """
+    A desk-like background with random clutter.
+    """
+    base = rng.integers(40, 140, 3).tolist()
+    frame = np.empty((height, width, 3), np.uint8)
+    frame[:] = base
+    scale = width / 640.0
+    for _ in range(int(rng.integers(5, 15))):
+        color = rng.integers(0, 255, 3).tolist()
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(10, 80) * scale)
+        if rng.random() < 0.5:
+            cv2.circle(frame, (x, y), size, color, -1)
+        else:
+            cv2.line(frame, (x, y), (x + size * 2, y + size), color, max(1, int(3 * scale)))
+    return frame
+
+
+def random_quad(rng, width, height):
+    """
+    Page corners (tl, tr, br, bl) with a random position, size and perspective.
+    """
+    page_h = height * rng.uniform(0.55, 0.85)
+    page_w = page_h / 1.414
+    cx = width / 2 + rng.uniform(-0.15, 0.15) * width
+    cy = height / 2 + rng.uniform(-0.05, 0.05) * height
+    quad = np.array([
+        [cx - page_w / 2, cy - page_h / 2],
+        [cx + page_w / 2, cy - page_h / 2],
+        [cx + page_w / 2, cy + page_h / 2],
+        [cx - page_w / 2, cy + page_h / 2]], dtype="float32")
+
+    # Perspective: move each corner independently
+    quad += rng.uniform(-0.08, 0.08, (4, 2)).astype("float32") * [page_w, page_h]
+    margin = 0.02 * min(width, height)
+    quad[:, 0] = np.clip(quad[:, 0], margin, width - margin)
+    quad[:, 1] = np.clip(quad[:, 1], margin, height - margin)
+    return quad
+
+
+def make_sample(rng, width, height, quality=90):
+    """
+    Returns the encoded JPEG and the ground truth corners (tl, tr, br, bl).
+    """
+    page = make_page(rng)
+    frame = make_background(rng, width, height)
+    quad = random_quad(rng, width, height)
+
+    # Composite the page into the scene
+    src = np.array([[0, 0], [page.shape[1] - 1, 0], [page.shape[1] - 1, page.shape[0] - 1], [0, page.shape[0] - 1]], dtype="float32")
+    M = cv2.getPerspectiveTransform(src, quad)
+    warped = cv2.warpPerspective(page, M, (width, height))
+    mask = cv2.warpPerspective(np.full(page.shape[:2], 255, np.uint8), M, (width, height))
+    frame[mask > 0] = warped[mask > 0]
+
+    # Lighting gradient in a random direction
+    angle = rng.uniform(0, 2 * np.pi)
+    xs, ys = np.meshgrid(np.linspace(-1, 1, width, dtype="float32"), np.linspace(-1, 1, height, dtype="float32"))
+    gradient = 0.85 + 0.25 * (np.cos(angle) * xs + np.sin(angle) * ys)
+    frame = frame.astype("float32") * gradient[:, :, None]
+
+    # Sensor noise
+    frame += rng.normal(0, 3, frame.shape).astype("float32")
+    frame = np.clip(frame, 0, 255).astype(np.uint8)
+
+    data = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+    return data, quad
+
+
+class StageTimes:
+    """
+    Profiler for DocumentScanner (see DocumentScanner.stage) that adds up the time
+    of each stage in a dict, reset with reset() between samples.
+    """
+    def __init__(self):
+        self.times = {}
+
+    def reset(self):
+        self.times = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+
+def run_sample(scanner, data, filter_type):
+    """
+    Runs the pipeline on one encoded frame with the scanner's own detect, warp and
+    filter code; scanner.profiler (a StageTimes) records the time of each stage.
+    Returns the stage timings (seconds) and the detected corners (or None).
+    """
+    profiler = scanner.profiler
+    profiler.reset()
+
+    with profiler.stage("decode"):
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    doc_contour, _ = scanner.detect_document(frame)
+    corners = None
+    page = frame
+    if doc_contour is not None:
+        corners = doc_contour.reshape(4, 2).astype("float32")
+        page = scanner.get_perspective_transform(frame, doc_contour.reshape(4, 2))
+
+    filtered = scanner.apply_filter(page, filter_type)
+    with profiler.stage("encode"):
+        cv2.imencode(".jpg", filtered)
+
+    return profiler.times, corners
+
+
+def corner_error(scanner, corners, truth):
+    """
+    Mean distance between detected and true corners, in pixels.
+    """
+    ordered = scanner.order_points(np.asarray(corners, dtype="float32").reshape(4, 2))
+    return float(np.linalg.norm(ordered - truth, axis=1).mean())
+
+
+def summarize(values):
+    values = np.asarray(values) * 1000.0
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def bench_resolution(name, args, scanner):
+    width, height = RESOLUTIONS[name]
+    rng = np.random.default_rng(args.seed)
+    samples = [make_sample(rng, width, height) for _ in range(args.samples)]
+
+    if args.save_dataset:
+        save_dataset(args.save_dataset, name, samples)
+
+    # Warm up (allocations, OpenCV thread pool)
+    for data, _ in samples[:2]:
+        run_sample(scanner, data, args.filter)
+
+    stage_times = {stage: [] for stage in STAGES}
+    totals = []
+    errors = []
+    correct = 0
+    diagonal = float(np.hypot(width, height))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    for data, truth in samples:
+        times, corners = run_sample(scanner, data, args.filter)
+        for stage in STAGES:
+            stage_times[stage].append(times.get(stage, 0.0))
+        totals.append(sum(times.values()))
+
+        if corners is not None:
+            error = corner_error(scanner, corners, truth)
+            errors.append(error)
+            if error < CORRECT_THRESHOLD * diagonal:
+                correct += 1
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "resolution": [width, height],
+        "samples": len(samples),
+        "throughput_fps": len(samples) / elapsed,
+        "total": summarize(totals),
+        "stages": {stage: summarize(values) for stage, values in stage_times.items()},
+        "peak_memory_mb": peak / (1024 * 1024),
+        "detection_rate": len(errors) / len(samples),
+        "correct_rate": correct / len(samples),
+        "corner_error_px": {
+            "mean": float(np.mean(errors)) if errors else None,
+            "p50": float(np.percentile(errors, 50)) if errors else None,
+            "p99": float(np.percentile(errors, 99)) if errors else None,
+        },
+    }
+
+
+def save_dataset(directory, name, samples):
+    os.makedirs(directory, exist_ok=True)
+    truth = {}
+    for i, (data, quad) in enumerate(samples):
+        filename = f"{name}_{i:03d}.jpg"
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(data)
+        truth[filename] = quad.tolist()
+    with open(os.path.join(directory, f"{name}_corners.json"), "w") as f:
+        json.dump(truth, f, indent=2)
+
+
+def print_report(report, baseline=None):
+    for name, result in report["results"].items():
+        print(f"\n{name} {result['resolution'][0]}x{result['resolution'][1]}: "
+              f"{result['throughput_fps']:.1f} fps, total p50 {result['total']['p50_ms']:.2f} ms, "
+              f"p99 {result['total']['p99_ms']:.2f} ms, peak {result['peak_memory_mb']:.1f} MB")
+        error = result["corner_error_px"]["mean"]
+        print(f"  detected {result['detection_rate']:.0%}, correct {result['correct_rate']:.0%}, "
+              f"corner error {error:.2f} px" if error is not None else "  no detections")
+
+        old = baseline["results"].get(name) if baseline else None
+        for stage, stats in result["stages"].items():
+            line = f"  {stage:<9} p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms"
+            if old and stage in old["stages"] and old["stages"][stage]["p50_ms"] > 0:
+                change = stats["p50_ms"] / old["stages"][stage]["p50_ms"] - 1
+                line += f"  ({change:+.0%} vs baseline)"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scanner pipeline on synthetic documents.")
+    parser.add_argument("--resolutions", default="vga,hd,fhd,4k", help="Comma separated: " + ", ".join(RESOLUTIONS))
+    parser.add_argument("--samples", type=int, default=20, help="Frames per resolution")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--filter", default="bw", choices=["bw", "gray", "original"])
+    parser.add_argument("--max-side", type=int, default=None, help="Detection max side (downscaled detection)")
+    parser.add_argument("--refine", action="store_true", help="Sub-pixel corner refinement")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--save-dataset", help="Also write the generated frames and corners here")
+    args = parser.parse_args()
+
+    scanner = DocumentScanner(detect_max_side=args.max_side, refine_corners=args.refine, profiler=StageTimes())
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "cv2_threads": cv2.getNumThreads(),
+        },
+        "config": vars(args),
+        "results": {},
+    }
+
+    for name in args.resolutions.split(","):
+        name = name.strip()
+        if name not in RESOLUTIONS:
+            parser.error(f"Unknown resolution: {name}")
+        print(f"Running {name}...")
+        report["results"][name] = bench_resolution(name, args, scanner)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_report(report, baseline)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
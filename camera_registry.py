@@ -0,0 +1,333 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+import cv2
+
+CameraInfo = namedtuple("CameraInfo", ["index", "name", "backend"])
+# What a camera actually delivered after opening (resolution from the first frame)
+CaptureInfo = namedtuple("CaptureInfo", ["index", "backend", "width", "height", "fps", "fourcc"])
+
+BACKEND_NAMES = {cv2.CAP_ANY: "Auto", cv2.CAP_DSHOW: "DSHOW"}
+
+# Backend/format that worked per camera and requested resolution, kept across runs
+PROFILES_PATH = os.path.join(os.path.expanduser("~"), ".smart_pdf_scanner", "cameras.json")
+
+# MJPG helps with Iriun/virtual cameras and USB bandwidth at high resolutions
+FOURCCS = ("MJPG", None)
+
+
+def fourcc_name(value):
+    code = int(value)
+    name = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+    return name if name.isprintable() and name.strip() else None
+
+
+def try_open(index, backend, width, height, fourcc):
+    """
+    Opens a camera with one backend/format combination and reads a test frame.
+    Returns (cap, CaptureInfo) or None.
+    """
+    cap = cv2.VideoCapture(index, backend)
+    if not cap.isOpened():
+        cap.release()
+        return None
+
+    # Format before resolution: some drivers only offer high resolutions in MJPG
+    if fourcc and not cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc)):
+        print(f"Index {index}: {fourcc} not accepted ({BACKEND_NAMES.get(backend, backend)})")
+    if not (cap.set(cv2.CAP_PROP_FRAME_WIDTH, width) and cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)):
+        print(f"Index {index}: {width}x{height} not accepted ({BACKEND_NAMES.get(backend, backend)})")
+
+    ret, frame = cap.read()
+    if not ret or frame is None:
+        cap.release()
+        return None
+
+    info = CaptureInfo(index, backend, frame.shape[1], frame.shape[0],
+                       cap.get(cv2.CAP_PROP_FPS), fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)))
+    if (info.width, info.height) != (width, height):
+        print(f"Index {index}: asked for {width}x{height}, got {info.width}x{info.height}")
+    return cap, info
+
+
+def try_open_with_timeout(timeout, *args):
+    """
+    try_open on a daemon thread. Gives up after timeout seconds (drivers can hang
+    in open); a camera that opens after that is released by the thread itself.
+    """
+    lock = threading.Lock()
+    state = {"abandoned": False, "result": None}
+
+    def run():
+        try:
+            result = try_open(*args)
+        except cv2.error as e:
+            print(f"Camera open error: {e}")
+            result = None
+        with lock:
+            if state["abandoned"]:
+                if result:
+                    result[0].release()
+            else:
+                state["result"] = result
+
+    thread = threading.Thread(target=run, name="camera-open", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    with lock:
+        if thread.is_alive():
+            state["abandoned"] = True
+            print(f"Camera {args[0]} open timed out ({BACKEND_NAMES.get(args[1], args[1])})")
+        return state["result"]
+
+
+def list_device_names():
+    """
+    DirectShow device names in index order (Windows only, needs pygrabber).
+    """
+    try:
+        from pygrabber.dshow_graph import FilterGraph
+        return FilterGraph().get_input_devices()
+    except ImportError:
+        print("pygrabber not installed or found")
+    except Exception as e:
+        print(f"pygrabber error: {e}")
+    return []
+
+
+def probe(index, backends):
+    """
+    Returns the first backend that opens the camera at index, or None.
+    """
+    for backend in backends:
+        cap = cv2.VideoCapture(index, backend)
+        try:
+            if cap.isOpened():
+                return backend
+        finally:
+            cap.release()
+    return None
+
+
+class CameraRegistry:
+    """
+    Cached list of cameras: display name <-> device index <-> working backend.
+
+    refresh() probes every index at once on background threads, so discovery
+    takes as long as the slowest camera (capped by probe_timeout) instead of the
+    sum of all of them, and never blocks the UI. The cache is only replaced by
+    the next refresh. A probe that hangs past the timeout is treated as absent
+    and left to finish on its own; its index is skipped until it does.
+
+    The backend, format and resolution a camera opened with are saved to
+    profiles_path, so the next open tries that combination before anything else.
+    """
+    def __init__(self, max_index=10, probe_timeout=3.0, open_timeout=5.0, profiles_path=PROFILES_PATH):
+        self.max_index = max_index
+        self.probe_timeout = probe_timeout
+        self.open_timeout = open_timeout
+        self.profiles_path = profiles_path
+        self.profiles = self.load_profiles()
+
+        self.cameras = [] # CameraInfo, in index order
+        self.by_name = {}
+        self.backends = {} # Index -> last backend that worked
+
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.refresh_thread = None
+        self.callbacks = []
+        self.stuck = set() # Indices whose probe outlived its timeout
+
+    def refresh(self, callback=None):
+        """
+        Starts a background rescan (or joins the running one). callback is called
+        with no arguments from the scan thread once the new list is in place.
+        """
+        with self.lock:
+            if callback:
+                self.callbacks.append(callback)
+            if self.refresh_thread is None:
+                self.refresh_thread = threading.Thread(target=self.run_refresh, name="camera-refresh", daemon=True)
+                self.refresh_thread.start()
+
+    def run_refresh(self):
+        try:
+            cameras = self.scan()
+        except Exception as e:
+            print(f"Camera scan failed: {e}")
+            cameras = None
+
+        with self.lock:
+            if cameras is not None:
+                self.cameras = cameras
+                self.by_name = {camera.name: camera for camera in cameras}
+                for camera in cameras:
+                    self.backends.setdefault(camera.index, camera.backend)
+            callbacks, self.callbacks = self.callbacks, []
+            self.refresh_thread = None
+        self.ready.set()
+
+        for callback in callbacks:
+            callback()
+
+    def scan(self):
+        names = list_device_names()
+        found = [None] * self.max_index # Working backend per index
+
+        def run_probe(index, backends):
+            found[index] = probe(index, backends)
+            self.stuck.discard(index)
+
+        threads = []
+        for index in range(self.max_index):
+            if index in self.stuck:
+                continue
+            # Named (DirectShow) devices are opened with DSHOW first, blind probes with Auto
+            if index < len(names):
+                backends = (self.backends.get(index, cv2.CAP_DSHOW), cv2.CAP_DSHOW, cv2.CAP_ANY)
+            else:
+                backends = (cv2.CAP_ANY, cv2.CAP_DSHOW)
+            thread = threading.Thread(target=run_probe, args=(index, tuple(dict.fromkeys(backends))),
+                                      name=f"camera-probe-{index}", daemon=True)
+            thread.start()
+            threads.append((index, thread))
+
+        # One deadline for all probes; they run in parallel
+        deadline = time.monotonic() + self.probe_timeout
+        timed_out = set()
+        for index, thread in threads:
+            thread.join(max(0, deadline - time.monotonic()))
+            if thread.is_alive():
+                print(f"Camera {index} probe timed out")
+                timed_out.add(index)
+                self.stuck.add(index)
+
+        cameras = []
+        used = set()
+        for index, backend in enumerate(found):
+            if backend is None or index in timed_out:
+                continue
+            name = names[index] if index < len(names) else f"Camera {index}"
+            if name in used:
+                # Two identical webcams: keep the names apart
+                name = f"{name} ({index})"
+            used.add(name)
+            cameras.append(CameraInfo(index, name, backend))
+        return cameras
+
+    def names(self):
+        with self.lock:
+            return [camera.name for camera in self.cameras]
+
+    def index_of(self, name):
+        """
+        Device index for a display name, or None if it isn't in the list.
+        """
+        with self.lock:
+            camera = self.by_name.get(name)
+        if camera is not None:
+            return camera.index
+        if name.startswith("Camera "):
+            try:
+                return int(name.split(" ")[1])
+            except ValueError:
+                pass
+        return None
+
+    def name_of(self, index):
+        with self.lock:
+            for camera in self.cameras:
+                if camera.index == index:
+                    return camera.name
+        return f"Camera {index}"
+
+    def backend_order(self, index):
+        """
+        Backends to try when opening index: the last one that worked first.
+        """
+        with self.lock:
+            remembered = self.backends.get(index)
+        order = [cv2.CAP_ANY, cv2.CAP_DSHOW]
+        if remembered is not None:
+            if remembered in order:
+                order.remove(remembered)
+            order.insert(0, remembered)
+        return order
+
+    def remember_backend(self, index, backend):
+        with self.lock:
+            self.backends[index] = backend
+
+    def load_profiles(self):
+        try:
+            with open(self.profiles_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Could not read camera profiles: {e}")
+            return {}
+
+    def save_profiles(self):
+        try:
+            os.makedirs(os.path.dirname(self.profiles_path), exist_ok=True)
+            with open(self.profiles_path, "w") as f:
+                json.dump(self.profiles, f, indent=2)
+        except OSError as e:
+            print(f"Could not save camera profiles: {e}")
+
+    def candidates(self, index, width, height):
+        """
+        (backend, width, height, fourcc) combinations to try, remembered one first.
+        """
+        combos = []
+        profile = self.profiles.get(f"{index}:{width}x{height}")
+        # Indices move when devices are plugged in; only trust a profile for the same name
+        if profile and (not self.ready.is_set() or profile["name"] in (None, self.name_of(index))):
+            combos.append((profile["backend"], profile["width"], profile["height"], profile["fourcc"]))
+        for backend in self.backend_order(index):
+            for fourcc in FOURCCS:
+                combos.append((backend, width, height, fourcc))
+        return list(dict.fromkeys(combos))
+
+    def open(self, index, width, height):
+        """
+        Opens a camera, trying the remembered combination first, then the other
+        backends and formats, then camera 0. Returns (cap, CaptureInfo) or
+        (None, None). Blocks; see open_async.
+        """
+        start = time.perf_counter()
+        for camera in dict.fromkeys((index, 0)):
+            for backend, w, h, fourcc in self.candidates(camera, width, height):
+                opened = try_open_with_timeout(self.open_timeout, camera, backend, w, h, fourcc)
+                if opened is None:
+                    continue
+
+                cap, info = opened
+                print(f"Camera {camera} opened in {time.perf_counter() - start:.2f}s with "
+                      f"{BACKEND_NAMES.get(backend, backend)}/{info.fourcc}: "
+                      f"{info.width}x{info.height} @ {info.fps:.0f} fps")
+                self.remember_backend(camera, backend)
+                # Ask for what was delivered next time, so there's nothing to negotiate
+                name = self.name_of(camera) if self.ready.is_set() else None
+                with self.lock:
+                    self.profiles[f"{camera}:{width}x{height}"] = {
+                        "name": name, "backend": backend, "fourcc": fourcc, "width": info.width, "height": info.height}
+                self.save_profiles()
+                return cap, info
+
+            if camera != 0:
+                print(f"Index {camera} failed completely. Falling back to Camera 0.")
+        return None, None
+
+    def open_async(self, index, width, height, callback):
+        """
+        Runs open() on a background thread and calls callback(cap, info) from it.
+        """
+        thread = threading.Thread(target=lambda: callback(*self.open(index, width, height)),
+                                  name="camera-open-chain", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,150 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from scanner import DocumentScanner
+from fusion import FrameFuser
+from dedup import PageDeduplicator, MAX_DISTANCE
+
+# status: "saved", "replaced" (existing was overwritten by filepath), "duplicate"
+# (nothing written, existing is the page it matched) or "failed"
+CaptureResult = namedtuple("CaptureResult", ["filepath", "image", "status", "existing"])
+
+
+class CapturePipeline:
+    """
+    Turns captured camera frames into saved pages on worker threads, so the UI
+    only has to hand over the frame (and the contour it already has).
+
+    Captures are numbered as they are submitted and on_saved is called in that
+    order, whatever order the workers finish in, so pages never swap places.
+    Nothing is dropped: the queue grows while the workers catch up, and depth()
+    reports how many captures are still waiting or being processed.
+
+    A capture can be a burst of frames of the same page; the worker keeps the
+    sharpest one (see DocumentScanner.sharpness) and drops the rest, or, with
+    fusion set, merges all of them into one less noisy page (see FrameFuser).
+
+    Every warped page is hashed (see PageDeduplicator). A burst submitted with
+    dedup="reject" is dropped if it is within dedup_distance bits of a page
+    already captured; with "replace" it overwrites that page instead. Nothing
+    is written to disk for a rejected capture.
+    """
+    def __init__(self, encoder, output_folder, workers=2, on_saved=None, dedup_distance=MAX_DISTANCE):
+        # Own scanner for manual captures without a contour (same settings as the live window)
+        self.scanner = DocumentScanner(detect_max_side=640, refine_corners=True)
+        self.fuser = FrameFuser(self.scanner)
+        self.dedup = PageDeduplicator(dedup_distance)
+        self.encoder = encoder
+        self.output_folder = output_folder
+        self.on_saved = on_saved # Called from a worker with a CaptureResult
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capture")
+
+        self.lock = threading.Lock()
+        self.next_seq = 0
+        self.next_emit = 0
+        self.last_timestamp = 0
+        self.finished = {} # Sequence number -> CaptureResult waiting for earlier captures
+
+    def depth(self):
+        with self.lock:
+            return self.next_seq - self.next_emit
+
+    def submit(self, frame, contour, filter_type):
+        """
+        Queues a capture. With contour=None the page is detected in the worker;
+        if none is found the whole frame is kept (saved as manual_<time>).
+        """
+        self.submit_burst([(frame, contour)], filter_type)
+
+    def submit_burst(self, frames, filter_type, fusion=None, dedup=None):
+        """
+        Queues a capture from several (frame, contour) pairs of the same page.
+        fusion: None to keep the sharpest frame, or "mean"/"median" to fuse them.
+        dedup: None to always save, or "reject"/"replace" for repeats of a page.
+        """
+        with self.lock:
+            # Name from capture time, not save time (and unique even within a millisecond)
+            timestamp = max(int(time.time() * 1000), self.last_timestamp + 1)
+            self.last_timestamp = timestamp
+            seq = self.next_seq
+            self.next_seq += 1
+        self.executor.submit(self.run, seq, frames, filter_type, fusion, dedup, timestamp)
+
+    def run(self, seq, frames, filter_type, fusion, dedup, timestamp):
+        try:
+            frame, contour = self.pick_sharpest(frames)
+            page = None
+            if fusion and len(frames) > 1 and contour is not None:
+                page = self.fuser.fuse(frames, contour, fusion)
+            result = self.process(frame, contour, filter_type, timestamp, page, dedup)
+        except Exception as e:
+            print(f"Capture failed: {e}")
+            result = CaptureResult(None, None, "failed", None)
+
+        with self.lock:
+            self.finished[seq] = result
+            ready = []
+            while self.next_emit in self.finished:
+                ready.append(self.finished.pop(self.next_emit))
+                self.next_emit += 1
+            # Callbacks stay under the lock so two workers can't interleave them
+            if self.on_saved:
+                for result in ready:
+                    self.on_saved(result)
+
+    def pick_sharpest(self, frames):
+        if len(frames) == 1:
+            return frames[0]
+        scores = [self.scanner.sharpness(frame, contour) for frame, contour in frames]
+        best = max(range(len(frames)), key=scores.__getitem__)
+        print(f"Burst: kept frame {best + 1}/{len(frames)} (sharpness {scores[best]:.0f}, "
+              f"worst {min(scores):.0f})")
+        return frames[best]
+
+    def process(self, frame, contour, filter_type, timestamp, page=None, dedup=None):
+        # 1. Warp (unless the page was already fused from several frames)
+        if contour is None:
+            contour, _ = self.scanner.detect_document(frame)
+        if page is not None:
+            name = f"scan_{timestamp}"
+        elif contour is not None:
+            page = self.scanner.get_perspective_transform(frame, contour.reshape(4, 2))
+            name = f"scan_{timestamp}"
+        else:
+            page = frame
+            name = f"manual_{timestamp}"
+
+        filepath = os.path.join(self.output_folder, f"{name}{self.encoder.extension(filter_type)}")
+
+        # 2. Skip or replace repeats (captures without dedup are always kept, but
+        # still recorded so later repeats of them are caught)
+        existing = self.dedup.check(page, filepath, keep=dedup is None)
+        status = "saved"
+        if existing is not None and dedup == "reject":
+            print(f"Duplicate of {os.path.basename(existing)}, not saved")
+            return CaptureResult(None, None, "duplicate", existing)
+        if existing is not None and dedup == "replace":
+            filepath = os.path.splitext(existing)[0] + self.encoder.extension(filter_type)
+            status = "replaced"
+
+        try:
+            # 3. Filter (Xerox look)
+            processed = self.scanner.apply_filter(page, filter_type=filter_type)
+
+            # 4. Save
+            self.encoder.save(processed, filepath, filter_type)
+        except Exception:
+            if status == "saved":
+                self.dedup.forget(filepath)
+            raise
+
+        if status == "replaced":
+            self.dedup.update(existing, page, filepath)
+            if filepath != existing and os.path.exists(existing):
+                os.remove(existing) # Filter changed, so did the extension
+        return CaptureResult(filepath, processed, status, existing)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,139 @@
+import threading
+import cv2
+import numpy as np
+
+DEDUP_MODES = ("reject", "replace")
+HASH_SIZE = 16 # 16x16 frequencies = 255 bit hashes; enough to tell text layouts apart
+# Bits that may differ between two captures of the same page. Measured on text
+# pages: recaptures (shifted a few pixels, other exposure) differ by up to ~50,
+# different pages by 90+.
+MAX_DISTANCE = 64
+
+
+def phash(image, hash_size=HASH_SIZE):
+    """
+    Perceptual hash of a page: signs of the lowest DCT frequencies of a small
+    grayscale copy (above/below their median), one bit each. Survives small
+    crop/warp differences, exposure changes and the scan filter, unlike a hash
+    of the file bytes.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    side = hash_size * 4
+    small = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA).astype(np.float32)
+    # Skip the DC term (overall brightness)
+    low = cv2.dct(small)[:hash_size, :hash_size].flatten()[1:]
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Metric tree over hashes: each child edge is labelled with its Hamming distance
+    to the parent, so a lookup only descends into edges within max_distance of
+    the query's own distance (triangle inequality) instead of comparing every
+    stored hash.
+
+    Items can be removed; their node stays behind to keep the tree valid.
+    """
+    def __init__(self):
+        self.root = None # [hash, items, {distance: child}]
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, {item}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {item}, {}]
+                return
+            node = child
+
+    def remove(self, value, item):
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if item in node[1]:
+                    node[1].discard(item)
+                    self.size -= 1
+                return
+            node = node[2].get(distance)
+
+    def search(self, value, max_distance):
+        """
+        (distance, item) pairs within max_distance of value, closest first.
+        """
+        found = []
+        pending = [self.root] if self.root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    pending.append(child)
+        return sorted(found, key=lambda match: match[0])
+
+
+class PageDeduplicator:
+    """
+    Remembers the pages of a session by perceptual hash and tells whether a new
+    capture is a near copy of one of them (within max_distance bits).
+    """
+    def __init__(self, max_distance=MAX_DISTANCE, hash_size=HASH_SIZE):
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.tree = BKTree()
+            self.hashes = {} # Page -> hash
+
+    def check(self, image, page, keep=False):
+        """
+        Looks the image up and, if it is new (or keep is set), records it as page
+        in the same step, so two workers can't both let the same page through.
+        Returns the closest existing page, or None if the image is new.
+        """
+        value = phash(image, self.hash_size)
+        with self.lock:
+            matches = self.tree.search(value, self.max_distance)
+            if not matches or keep:
+                self.tree.add(value, page)
+                self.hashes[page] = value
+            return matches[0][1] if matches else None
+
+    def update(self, page, image, new_page=None):
+        """
+        Re-hashes a page whose image was replaced (optionally under a new name).
+        """
+        value = phash(image, self.hash_size)
+        with self.lock:
+            self.forget_locked(page)
+            self.tree.add(value, new_page or page)
+            self.hashes[new_page or page] = value
+
+    def forget(self, page):
+        with self.lock:
+            self.forget_locked(page)
+
+    def forget_locked(self, page):
+        value = self.hashes.pop(page, None)
+        if value is not None:
+            self.tree.remove(value, page)
@@ -0,0 +1,92 @@
+import io
+import os
+import cv2
+import numpy as np
+from PIL import Image
+
+# File extension per output format
+EXTENSIONS = {"png": ".png", "tiff": ".tif", "jpeg": ".jpg", "webp": ".webp"}
+
+BW_FORMATS = ("png", "tiff")
+TONE_FORMATS = ("jpeg", "webp")
+
+
+class ScanEncoder:
+    """
+    Picks the file format of a saved scan from its filter.
+
+    bw pages are bilevel, so they are stored losslessly at 1 bit per pixel:
+    PNG (Flate) or TIFF with CCITT Group 4, the fax codec, which is usually
+    several times smaller still on text. Gray and color pages use JPEG or WebP
+    at a set quality.
+
+    PDF compilation embeds JPEG, PNG and Group 4 TIFF files without re-encoding;
+    WebP has no PDF filter and is converted to JPEG at that point.
+    """
+    def __init__(self, bw_format="png", tone_format="jpeg", jpeg_quality=85, webp_quality=80):
+        if bw_format not in BW_FORMATS:
+            raise ValueError(f"bw_format must be one of {BW_FORMATS}")
+        if tone_format not in TONE_FORMATS:
+            raise ValueError(f"tone_format must be one of {TONE_FORMATS}")
+
+        self.bw_format = bw_format
+        self.tone_format = tone_format
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+
+    def format(self, filter_type):
+        return self.bw_format if filter_type == "bw" else self.tone_format
+
+    def extension(self, filter_type):
+        return EXTENSIONS[self.format(filter_type)]
+
+    def encode(self, image, filter_type):
+        """
+        Returns the encoded file contents for a filtered page.
+        """
+        fmt = self.format(filter_type)
+        if fmt == "png":
+            # Threshold output is 0/255, written as a 1-bit grayscale PNG
+            ok, data = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_BILEVEL, 1])
+        elif fmt == "tiff":
+            return encode_group4(image)
+        elif fmt == "webp":
+            ok, data = cv2.imencode(".webp", image, [cv2.IMWRITE_WEBP_QUALITY, self.webp_quality])
+        else:
+            ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality,
+                                                    cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+        if not ok:
+            raise ValueError(f"Could not encode page as {fmt}")
+        return data.tobytes()
+
+    def save(self, image, path, filter_type):
+        """
+        Writes a filtered page to path, which should end in extension(filter_type).
+        """
+        with open(path, "wb") as f:
+            f.write(self.encode(image, filter_type))
+
+
+def encode_group4(image):
+    """
+    Single strip TIFF with CCITT Group 4 compression (what fax machines and most
+    scanners use for bilevel pages). One strip lets a PDF embed it as one image.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    bilevel = Image.fromarray(np.ascontiguousarray(image)).convert("1", dither=Image.Dither.NONE)
+    buf = io.BytesIO()
+    row_bytes = (image.shape[1] + 7) // 8
+    bilevel.save(buf, format="TIFF", compression="group4", strip_size=row_bytes * image.shape[0])
+    return buf.getvalue()
+
+
+def encoder_from_env():
+    """
+    Encoder configured by SCAN_BW_FORMAT, SCAN_TONE_FORMAT, SCAN_JPEG_QUALITY
+    and SCAN_WEBP_QUALITY.
+    """
+    return ScanEncoder(bw_format=os.environ.get("SCAN_BW_FORMAT", "png"),
+                       tone_format=os.environ.get("SCAN_TONE_FORMAT", "jpeg"),
+                       jpeg_quality=int(os.environ.get("SCAN_JPEG_QUALITY", "85")),
+                       webp_quality=int(os.environ.get("SCAN_WEBP_QUALITY", "80")))
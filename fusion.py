@@ -0,0 +1,60 @@
+import threading
+import cv2
+import numpy as np
+
+FUSION_METHODS = ("mean", "median")
+
+
+class FrameFuser:
+    """
+    Merges a burst of frames of one page into a single, less noisy page.
+
+    Each frame is warped with its own tracked quad to the same page size, which
+    aligns the page pixel for pixel before merging. "mean" adds the frames into
+    a float32 accumulator (noise drops with the square root of the frame count);
+    "median" also rejects outliers such as a flicker or a passing shadow, but
+    costs more.
+
+    Buffers are allocated per worker thread for the current page size and
+    reused, so memory stays at one float page (mean) or max_frames pages
+    (median) per worker however many captures go through.
+    """
+    def __init__(self, scanner, max_frames=5):
+        self.scanner = scanner
+        self.max_frames = max_frames
+        self.local = threading.local()
+
+    def buffer(self, name, shape, dtype):
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+        buf = buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = buffers[name] = np.empty(shape, dtype)
+        return buf
+
+    def fuse(self, frames, reference, method="mean"):
+        """
+        frames: (frame, contour) pairs of the same page; the newest max_frames
+        are used. reference: contour giving the output size (e.g. the sharpest
+        frame's). Returns the fused page as uint8.
+        """
+        frames = frames[-self.max_frames:]
+        width, height = self.scanner.page_size(self.scanner.order_points(reference.reshape(4, 2)))
+        shape = (height, width) + frames[0][0].shape[2:]
+
+        with self.scanner.stage("fuse"):
+            if method == "median":
+                stack = self.buffer("stack", (self.max_frames,) + shape, np.uint8)
+                for i, (frame, contour) in enumerate(frames):
+                    self.scanner.get_perspective_transform(frame, contour, size=(width, height), out=stack[i])
+                fused = np.median(stack[:len(frames)], axis=0, overwrite_input=True)
+                return np.rint(fused).astype(np.uint8)
+
+            accumulator = self.buffer("accumulator", shape, np.float32)
+            warped = self.buffer("warped", shape, np.uint8)
+            accumulator.fill(0)
+            for frame, contour in frames:
+                self.scanner.get_perspective_transform(frame, contour, size=(width, height), out=warped)
+                cv2.accumulate(warped, accumulator)
+            return cv2.convertScaleAbs(accumulator, alpha=1.0 / len(frames))
@@ -5,10 +5,17 @@ from PIL import Image, ImageTk
 import os
 import threading
 import time
-import numpy as np
+import queue
+from collections import deque
 from scanner import DocumentScanner
-from fpdf import FPDF
-from pygrabber.dshow_graph import FilterGraph
+from pdf_writer import write_pdf
+from live_feed import LiveFeed
+from previews import PreviewStore
+from encoding import ScanEncoder
+from capture_pipeline import CapturePipeline
+from search_index import SearchIndex, PageIndexer
+from camera_registry import CameraRegistry
+from warp_maps import LOCK_TOLERANCE
 
 # Silence OpenCV errors globally and early
 try:
@@ -31,9 +38,28 @@ class ASEPScannerGUI(ctk.CTk):
         self.settings = {"camera_index": 0}  # Default settings
         self.scanner = DocumentScanner()
         self.captured_images = []
+        self.scanner_window = None # Open ScannerWindow, shows capture outcomes
         self.output_folder = "scanned_docs"
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
+        self.previews = PreviewStore(os.path.join(self.output_folder, "previews"))
+        # 1-bit PNG for B&W pages, JPEG for gray and color
+        self.encoder = ScanEncoder()
+
+        # Callbacks from worker threads, run on the Tk thread by process_ui_queue
+        self.ui_queue = queue.Queue()
+
+        # Saved pages are OCRed in the background into an on-disk search index
+        self.search_index = SearchIndex(os.path.join(self.output_folder, "search_index.jsonl"))
+        self.indexer = PageIndexer(self.search_index, on_indexed=lambda page: self.post_to_ui(self.page_indexed, page))
+
+        # Captured frames are warped, filtered and saved off the Tk thread
+        self.captures = CapturePipeline(self.encoder, self.output_folder,
+                                        on_saved=lambda result: self.post_to_ui(self.capture_saved, result))
+
+        # Camera list is probed in the background so Preferences opens instantly
+        self.cameras = CameraRegistry()
+        self.cameras.refresh()
 
         # Layout
         self.grid_columnconfigure(1, weight=1)
@@ -56,7 +82,9 @@ class ASEPScannerGUI(ctk.CTk):
         self.btn_search = ctk.CTkButton(self.sidebar, text="Search Pages", command=self.toggle_search, fg_color="gray")
         self.btn_search.grid(row=3, column=0, padx=20, pady=5)
 
-        self.search_entry = ctk.CTkEntry(self.sidebar, placeholder_text="Type to search...")
+        self.search_entry = ctk.CTkEntry(self.sidebar, placeholder_text="Type to search..." if self.indexer.enabled
+                                         else "Install Tesseract to search")
+        self.search_entry.bind("<KeyRelease>", self.run_search)
         # Initially hidden, will be gridded in toggle_search
 
         self.listbox_label = ctk.CTkLabel(self.sidebar, text="Captured Pages:", anchor="w")
@@ -80,21 +108,89 @@ class ASEPScannerGUI(ctk.CTk):
         self.preview_label = ctk.CTkLabel(self.main_area, text="No scans yet.\nClick 'Start Scanning' to begin.", font=ctk.CTkFont(size=16))
         self.preview_label.pack(expand=True, fill="both")
 
+        self.after(50, self.process_ui_queue)
+
+    def post_to_ui(self, callback, *args):
+        # Safe to call from any thread; Tk widgets are only touched by the main loop
+        self.ui_queue.put((callback, args))
+
+    def process_ui_queue(self):
+        while True:
+            try:
+                callback, args = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"UI callback failed: {e}")
+        self.after(50, self.process_ui_queue)
+
     def open_scanner(self):
-        ScannerWindow(self)
+        self.scanner_window = ScannerWindow(self)
 
-    def add_image(self, filepath):
+    def capture_saved(self, result):
+        if result.status == "failed":
+            messagebox.showerror("Capture failed", "The page could not be saved.")
+            return
+        if result.status == "duplicate":
+            # Same page as one already captured; nothing was written
+            if result.existing in self.captured_images:
+                message = f"Already captured (page {self.captured_images.index(result.existing) + 1}), skipped"
+            else:
+                message = "Already captured, skipped"
+            if self.scanner_window is not None:
+                self.scanner_window.show_notice(message)
+            return
+        if result.status == "replaced" and result.existing in self.captured_images:
+            print(f"Replaced: {result.existing} -> {result.filepath}")
+            self.replace_image(result.existing, result.filepath, result.image)
+            return
+        print(f"Saved: {result.filepath}")
+        self.add_image(result.filepath, result.image)
+
+    def add_image(self, filepath, image=None):
         self.captured_images.append(filepath)
-        self.pages_text.insert("end", f"{os.path.basename(filepath)}\n")
-        
-        # Show preview of last image
-        img = Image.open(filepath)
-        img.thumbnail((600, 600))
+        self.indexer.submit(filepath, filepath)
+        if self.search_entry.get().strip():
+            self.run_search()
+        else:
+            self.pages_text.insert("end", f"{os.path.basename(filepath)}\n")
+        
+        # Preview of last image is downscaled and loaded in the background
+        # (pass the image when it's still in memory to skip decoding the file)
+        self.previews.submit(filepath, image).add_done_callback(self.load_preview)
+
+    def replace_image(self, old_path, filepath, image=None):
+        # A newer capture of the same page: keep its place in the document
+        self.captured_images[self.captured_images.index(old_path)] = filepath
+        self.search_index.remove(old_path)
+        self.indexer.submit(filepath, filepath)
+        self.run_search()
+        self.previews.submit(filepath, image).add_done_callback(self.load_preview)
+
+    def load_preview(self, future):
+        # Runs on the preview thread (or here, if the preview already existed)
+        if future.exception() is not None:
+            print(f"Preview failed: {future.exception()}")
+            return
+        img = Image.open(future.result()[max(self.previews.sizes)])
+        img.load()
+        self.post_to_ui(self.show_preview, img)
+
+    def show_preview(self, img):
+        if not self.captured_images:
+            return # Compiled (and cleared) while the preview was loading
         ctk_img = ctk.CTkImage(light_image=img, dark_image=img, size=img.size)
         self.preview_label.configure(image=ctk_img, text="")
         self.preview_label.image = ctk_img
 
     def compile_pdf(self):
+        pending = self.captures.depth()
+        if pending:
+            messagebox.showwarning("Busy", f"Still saving {pending} page(s), try again in a moment.")
+            return
+
         if not self.captured_images:
             messagebox.showwarning("Empty", "No images to compile!")
             return
@@ -103,26 +199,43 @@ class ASEPScannerGUI(ctk.CTk):
         if not output_filename:
             return
             
-        pdf = FPDF()
-        for img_path in self.captured_images:
-            pdf.add_page()
-            pdf.image(img_path, x=0, y=0, w=210) # Fit to A4 width
-            
-        pdf.output(output_filename)
+        # Pages are streamed to disk one at a time (A4, fit to width)
+        write_pdf(self.captured_images, output_filename)
         messagebox.showinfo("Success", "PDF Compiled Successfully!")
         
         # Clear session
         self.captured_images = []
+        self.captures.dedup.reset()
         self.pages_text.delete("1.0", "end")
         self.preview_label.configure(image=None, text="Compilation Complete.\nReady for next batch.")
 
     def toggle_search(self):
         if self.search_entry.winfo_viewable():
             self.search_entry.grid_forget()
+            # Back to the full list
+            self.search_entry.delete(0, "end")
+            self.run_search()
         else:
             self.search_entry.grid(row=4, column=0, padx=20, pady=5)
             self.search_entry.focus()
 
+    def run_search(self, event=None):
+        # Index lookups only (no OCR here), so this is fast enough for every keystroke
+        query = self.search_entry.get().strip()
+        pages = self.captured_images
+        if query:
+            matches = self.search_index.search(query)
+            pages = [path for path in self.captured_images if path in matches]
+
+        self.pages_text.delete("1.0", "end")
+        for path in pages:
+            self.pages_text.insert("end", f"{os.path.basename(path)}\n")
+
+    def page_indexed(self, page):
+        # A page just became searchable; refresh the results if a search is active
+        if self.search_entry.get().strip():
+            self.run_search()
+
     def open_about(self):
         AboutWindow(self)
 
@@ -141,98 +254,102 @@ class ScannerWindow(ctk.CTkToplevel):
         camera_idx = self.parent.settings.get("camera_index", 0)
         self.high_quality = self.parent.settings.get("high_quality", False)
         
-        # Try to open camera with robust backend fallback
-        self.cap = self.open_camera_robust(camera_idx)
-        
-        if not self.cap or not self.cap.isOpened():
-             self.video_label.configure(text="Error: Is the camera connected?")
-        
         self.video_label = ctk.CTkLabel(self, text="")
         self.video_label.pack(fill="both", expand=True)
         
         self.status_label = ctk.CTkLabel(self, text="Looking for document...", font=("Arial", 16))
         self.status_label.pack(pady=10)
+
+        # Measured capture/detection rates
+        self.stats_label = ctk.CTkLabel(self, text="", font=("Arial", 11), text_color="gray")
+        self.stats_label.pack()
+        self.last_stats_update = 0
         
         self.btn_capture = ctk.CTkButton(self, text="Manual Capture", command=self.manual_capture)
         self.btn_capture.pack(pady=10)
 
-        self.scanner = DocumentScanner() # Initialize scanner logic
+        # Detect on a 640px copy so 1080p feeds stay responsive; warps use the full frame
+        self.scanner = DocumentScanner(detect_max_side=640, refine_corners=True)
+
+        # Camera reads and detection run on background threads (see live_feed.py)
+        self.cap = None
+        self.feed = None
+        self.closed = False
+        self.camera_info = ""
+
+        # Open in the background: remembered backend/format first, then the fallbacks
+        self.video_label.configure(text="Opening camera...")
+        width, height = (1920, 1080) if self.high_quality else (640, 480)
+        self.parent.cameras.open_async(camera_idx, width, height,
+                                       lambda cap, info: self.parent.post_to_ui(self.camera_opened, cap, info))
         
         # Black screen detector variables
         self.black_frame_count = 0
         self.black_screen_warning = False
 
         # Auto-capture variables
-        self.last_contour = None
         self.stable_frames = 0
         self.required_stable_frames = 15 
+        self.stable_motion = 0.003 # Max corner motion per frame (fraction of the frame diagonal)
         self.cooldown = 0
+
+        # Last few stable frames; the capture keeps the sharpest of them
+        self.burst = deque(maxlen=5)
+
+        # Capture outcome shown in place of the status for a moment (see show_notice)
+        self.notice = None
+        self.notice_until = 0
         
         self.protocol("WM_DELETE_WINDOW", self.close)
-        self.update_feed()
 
-    def open_camera_robust(self, index):
-        """Tries to open camera with Auto backend, then DSHOW if that fails to read."""
-        # Helper to configure
-        def configure_cap(cap):
-            # Apply resolution based on settings
-            if self.high_quality:
-                cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
-            else:
-                cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                
-            # Try to force MJPG (helps with Iriun/Virtual)
-            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
-            
-        # 1. Try Auto
-        cap = cv2.VideoCapture(index)
-        if cap.isOpened():
-            configure_cap(cap)
-            # Test read
-            ret, _ = cap.read()
-            if ret:
-                return cap
-            else:
-                print(f"Index {index} opened but failed to read (Auto). Trying DSHOW...")
-                cap.release()
-        
-        # 2. Try DSHOW (Virtual cameras often need this)
-        cap = cv2.VideoCapture(index, cv2.CAP_DSHOW)
-        if cap.isOpened():
-            configure_cap(cap)
-            ret, _ = cap.read()
-            if ret:
-                print(f"Index {index} working with DSHOW.")
-                return cap
-            else:
+    def camera_opened(self, cap, info):
+        # Called on the Tk thread once the open chain finishes
+        if self.closed:
+            if cap:
                 cap.release()
-                
-        # 3. Fallback to 0 if we weren't already trying 0
-        if index != 0:
-            print(f"Index {index} failed completely. Falling back to Camera 0.")
-            return self.open_camera_robust(0)
-            
-        return None
+            return
 
-        # Auto-capture variables
-        self.last_contour = None
-        self.stable_frames = 0
-        self.required_stable_frames = 15 # Approx 0.5-1 sec depending on FPS
-        self.cooldown = 0
-        
-        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.cap = cap
+        if cap is None:
+            self.video_label.configure(text="Error: Is the camera connected?")
+            return
+
+        self.camera_info = f"{info.width}x{info.height} @ {info.fps:.0f} fps"
+        self.video_label.configure(text="")
+        self.feed = LiveFeed(self.cap, self.scanner)
+        self.feed.start()
         self.update_feed()
 
     def update_feed(self):
-        ret, frame = self.cap.read()
-        if not ret:
+        if self.feed is None:
+            return
+        if self.feed.failed:
             self.video_label.configure(text="Camera disconnected or stalled.")
             return
 
+        result = self.feed.results.get_nowait()
+        if result is not None:
+            self.show_result(result)
+
+        # Refresh the rate counters twice a second
+        now = time.time()
+        if now - self.last_stats_update > 0.5:
+            stats = self.feed.stats()
+            self.stats_label.configure(text=f"{self.camera_info} | "
+                                            f"Capture {stats['capture_fps']:.1f} fps | "
+                                            f"Detection {stats['detect_fps']:.1f} fps | "
+                                            f"Dropped {stats['dropped']} | "
+                                            f"Tracked {stats['tracked_frames']} / Full {stats['full_detections']} | "
+                                            f"Saving {self.parent.captures.depth()}")
+            self.last_stats_update = now
+
+        self.after(10, self.update_feed)
+
+    def show_result(self, result):
+        frame, doc_contour = result.frame, result.contour
+
         # Check for black screen (virtual camera issue)
-        if np.mean(frame) < 10:
+        if result.brightness < 10:
             self.black_frame_count += 1
         else:
             self.black_frame_count = 0
@@ -244,91 +361,82 @@ class ScannerWindow(ctk.CTkToplevel):
              self.status_label.configure(text="Looking for document...", text_color="white")
              self.black_screen_warning = False
 
-        # Detection
-        doc_contour, edged = self.scanner.detect_document(frame)
-        
-        display_frame = frame.copy()
-        
         if doc_contour is not None:
-            cv2.drawContours(display_frame, [doc_contour], -1, (0, 255, 0), 2)
-            
             # Check stability for auto-capture
             if self.cooldown > 0:
                 self.cooldown -= 1
                 self.status_label.configure(text=f"Captured! Cooldown... {self.cooldown}", text_color="green")
             else:
-                if self.is_stable(doc_contour):
+                if self.is_stable(result.motion):
                     self.stable_frames += 1
+                    self.burst.append((frame, doc_contour))
                     self.status_label.configure(text=f"Hold still... {self.stable_frames}/{self.required_stable_frames}", text_color="orange")
                     
                     if self.stable_frames >= self.required_stable_frames:
                         self.auto_capture(frame, doc_contour)
                 else:
                     self.stable_frames = 0
+                    self.burst.clear()
                     self.status_label.configure(text="Align document", text_color="white")
-                    
-            self.last_contour = doc_contour
         else:
             self.stable_frames = 0
+            self.burst.clear()
             self.status_label.configure(text="No document detected", text_color="gray")
 
-        # Convert to Tkinter
-        cv2_image = cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)
-        img = Image.fromarray(cv2_image)
-        imgtk = ctk.CTkImage(light_image=img, dark_image=img, size=(640, 480))
+        if self.notice and time.time() < self.notice_until:
+            self.status_label.configure(text=self.notice, text_color="orange")
+
+        # The preview is already drawn and converted by the detection thread
+        imgtk = ctk.CTkImage(light_image=result.preview, dark_image=result.preview, size=(640, 480))
         self.video_label.configure(image=imgtk)
         self.video_label.image = imgtk
-        
-        self.after(30, self.update_feed)
 
-    def is_stable(self, contour):
-        if self.last_contour is None: return False
-        return cv2.matchShapes(contour, self.last_contour, 1, 0.0) < 0.1
+    def is_stable(self, motion):
+        # Tracked corner motion covers translation and scale, unlike shape matching
+        if motion is None: return False
+        return motion < self.stable_motion
 
     def auto_capture(self, frame, contour):
-        # 1. Warp
-        warped = self.scanner.get_perspective_transform(frame, contour.reshape(4, 2))
-        
-        # 2. Filter (Xerox look)
-        # Get filter setting
+        # Warp, filter and save happen on the capture workers; the page is added
+        # to the list when they're done (frames aren't reused by the capture thread)
+        # The burst ends with this frame; a worker scores them and keeps the sharpest
         filter_mode = self.parent.settings.get("scan_filter", "bw") # Default B&W
-        processed = self.scanner.apply_filter(warped, filter_type=filter_mode)
-        
-        # 3. Save
-        timestamp = int(time.time() * 1000)
-        filename = f"scan_{timestamp}.jpg"
-        filepath = os.path.join(self.parent.output_folder, filename)
-        cv2.imwrite(filepath, processed)
-        
-        # 4. Notify
-        self.parent.add_image(filepath)
+        frames = list(self.burst) or [(frame, contour)]
+        # Optional low-light mode: fuse the whole burst instead
+        fusion = self.parent.settings.get("fusion")
+        # Holding the same page up again doesn't add it twice (see dedup.py)
+        dedup = self.parent.settings.get("dedup", "reject")
+        self.parent.captures.submit_burst(frames, filter_mode, fusion=fusion, dedup=dedup)
+
         self.cooldown = 30 # Wait 30 frames before next capture
         self.stable_frames = 0
-        print(f"Auto-captured: {filepath}")
+        self.burst.clear()
+        print(f"Auto-captured ({self.parent.captures.depth()} in queue)")
+
+    def show_notice(self, text, seconds=2.0):
+        # Status updates run per frame, so keep the notice on top until it expires
+        self.notice = text
+        self.notice_until = time.time() + seconds
+        self.status_label.configure(text=text, text_color="orange")
 
     def manual_capture(self):
         # Capture raw frame if no doc detected, or warp if detected
-        ret, frame = self.cap.read()
-        if ret:
-            # Check filter
+        # (the capture thread owns the camera, so use its newest frame)
+        frame = self.feed.latest_frame if self.feed else None
+        if frame is not None:
+            # Detection runs on the capture workers too. If no document is found, the
+            # frame is saved whole, still with the current "Scan Mode" filter
             filter_mode = self.parent.settings.get("scan_filter", "bw")
-            
-            doc_contour, _ = self.scanner.detect_document(frame)
-            if doc_contour is not None:
-                self.auto_capture(frame, doc_contour)
-            else:
-                # Save raw but processed with filter if desired?
-                # Usually manual capture of generic scene might want color, but if "Scan Mode" is B&W, assume user wants that.
-                processed = self.scanner.apply_filter(frame, filter_type=filter_mode)
-                
-                timestamp = int(time.time() * 1000)
-                filename = f"manual_{timestamp}.jpg"
-                filepath = os.path.join(self.parent.output_folder, filename)
-                cv2.imwrite(filepath, processed)
-                self.parent.add_image(filepath)
+            self.parent.captures.submit(frame, None, filter_mode)
 
     def close(self):
-        self.cap.release()
+        self.closed = True
+        if self.parent.scanner_window is self:
+            self.parent.scanner_window = None
+        if self.feed:
+            self.feed.stop() # The capture thread releases the camera
+        elif self.cap:
+            self.cap.release()
         self.destroy()
 
 
@@ -372,7 +480,7 @@ class PreferencesWindow(ctk.CTkToplevel):
         super().__init__(parent)
         self.parent = parent
         self.title("Preferences")
-        self.geometry("400x450") # Increased height for more options
+        self.geometry("400x650") # Increased height for more options
         self.resizable(False, False)
         self.transient(parent)
         self.grab_set()
@@ -383,14 +491,12 @@ class PreferencesWindow(ctk.CTkToplevel):
         self.camera_label = ctk.CTkLabel(self, text="Select Camera:")
         self.camera_label.pack(pady=5)
 
-        # Detect cameras
+        # Cached camera list (see CameraRegistry)
         self.available_cameras = self.detect_cameras()
         
         # Get current camera name if possible, else default to index
         current_idx = self.parent.settings.get("camera_index", 0)
-        current_name = f"Camera {current_idx}" # fallback
-        if current_idx < len(self.available_cameras):
-            current_name = self.available_cameras[current_idx]
+        current_name = self.parent.cameras.name_of(current_idx)
             
         self.camera_var = ctk.StringVar(value=current_name)
 
@@ -406,6 +512,13 @@ class PreferencesWindow(ctk.CTkToplevel):
         self.quality_switch.pack(pady=10)
         ToolTip(self.quality_switch, "Attempt to capture at 1920x1080 resolution.\nTurn OFF if you experience black screens or lag.")
 
+        # Locked geometry (camera on a stand)
+        self.stand_switch = ctk.CTkSwitch(self, text="Fixed Camera Stand", command=self.toggle_stand)
+        if self.parent.settings.get("locked_geometry", False):
+            self.stand_switch.select()
+        self.stand_switch.pack(pady=10)
+        ToolTip(self.stand_switch, "Turn ON if the camera doesn't move between pages.\nReuses the page geometry so each capture is saved faster.")
+
         # Filter Settings
         self.filter_label = ctk.CTkLabel(self, text="Scan Mode:")
         self.filter_label.pack(pady=5)
@@ -427,6 +540,28 @@ class PreferencesWindow(ctk.CTkToplevel):
         self.filter_menu.pack(pady=10)
         ToolTip(self.filter_menu, "Select the visual style for captures:\n- Black & White: High contrast, like a document scan.\n- Grayscale: For photos/texture.\n- Color: Unfiltered raw image.")
 
+        # Low-light fusion
+        self.fusion_label = ctk.CTkLabel(self, text="Low-light Noise Reduction:")
+        self.fusion_label.pack(pady=5)
+
+        self.fusion_map = {"Off": None, "Average (fast)": "mean", "Median (removes flicker)": "median"}
+        current_fusion = next((k for k, v in self.fusion_map.items() if v == self.parent.settings.get("fusion")), "Off")
+        self.fusion_var = ctk.StringVar(value=current_fusion)
+        self.fusion_menu = ctk.CTkOptionMenu(self, variable=self.fusion_var, values=list(self.fusion_map.keys()), command=self.change_fusion)
+        self.fusion_menu.pack(pady=10)
+        ToolTip(self.fusion_menu, "Combine the last few frames of a steady page into one.\nReduces grain and speckles in dim rooms.")
+
+        # Repeated auto-captures of the same page
+        self.dedup_label = ctk.CTkLabel(self, text="Repeated Pages:")
+        self.dedup_label.pack(pady=5)
+
+        self.dedup_map = {"Skip repeats": "reject", "Replace with newer": "replace", "Keep all": None}
+        current_dedup = next((k for k, v in self.dedup_map.items() if v == self.parent.settings.get("dedup", "reject")), "Skip repeats")
+        self.dedup_var = ctk.StringVar(value=current_dedup)
+        self.dedup_menu = ctk.CTkOptionMenu(self, variable=self.dedup_var, values=list(self.dedup_map.keys()), command=self.change_dedup)
+        self.dedup_menu.pack(pady=10)
+        ToolTip(self.dedup_menu, "What to do when auto-capture sees a page you already scanned.\nManual captures are always kept.")
+
         self.btn_refresh = ctk.CTkButton(self, text="Refresh Cameras", command=self.refresh_cameras, fg_color="gray")
         self.btn_refresh.pack(pady=5)
         ToolTip(self.btn_refresh, "Reload the list of available cameras.\nUse this if you plugged in a camera after opening the app.")
@@ -434,84 +569,30 @@ class PreferencesWindow(ctk.CTkToplevel):
         self.close_btn = ctk.CTkButton(self, text="Close", command=self.destroy)
         self.close_btn.pack(pady=20)
 
+        # First scan still running: fill the list in when it's done
+        if not self.parent.cameras.ready.is_set():
+            self.refresh_cameras()
+
     def detect_cameras(self):
         """
-        Robust detection:
-        1. Get names from pygrabber (DirectShow).
-        2. Probe indices 0-5 with cv2.
-        3. Merge results.
+        Camera names from the registry cache (probed in the background at startup),
+        so the window opens without touching any device.
         """
-        # Silence OpenCV errors safely (already done globally, but keep for safety in this scope if needed/reload)
-        try:
-            cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_SILENT)
-        except AttributeError:
-            pass 
-        
-        # 1. Get names
-        grabber_names = []
-        try:
-            from pygrabber.dshow_graph import FilterGraph
-            graph = FilterGraph()
-            grabber_names = graph.get_input_devices()
-        except ImportError:
-            print("pygrabber not installed or found")
-        except Exception as e:
-            print(f"pygrabber error: {e}")
-
-        # 2. Probe & Merge
-        final_list = []
-        consecutive_failures = 0
-        
-        # Check up to 10 indices, but stop early if we find nothing
-        for i in range(10): 
-            try:
-                # Decide backend strategy
-                # If we have a name from pygrabber, we can be more aggressive/specific (DSHOW)
-                # If we are probing blind, be gentle (Auto).
-                
-                is_known_device = i < len(grabber_names)
-                
-                cap = None
-                if is_known_device:
-                    # We expect a camera here, try DSHOW directly as it maps to pygrabber names
-                    cap = cv2.VideoCapture(i, cv2.CAP_DSHOW)
-                    if not cap.isOpened():
-                         cap = cv2.VideoCapture(i) # Fallback to Auto
-                else:
-                    # Blind probe
-                    cap = cv2.VideoCapture(i)
-                    if not cap.isOpened() and consecutive_failures == 0:
-                         # Only try DSHOW fallback if we haven't failed recently (to avoid spam)
-                         cap = cv2.VideoCapture(i, cv2.CAP_DSHOW)
-
-                if cap is not None and cap.isOpened():
-                    # Camera exists
-                    is_working = True # Assume yes
-                    cap.release()
-                    
-                    consecutive_failures = 0 # Reset counter
-                    
-                    if i < len(grabber_names):
-                        final_list.append(grabber_names[i])
-                    else:
-                        final_list.append(f"Camera {i}")
-                else:
-                    consecutive_failures += 1
-            except:
-                consecutive_failures += 1
-                
-            # If we fail 2 times in a row, assume no more cameras exist
-            # gaps are rare (e.g. 0, 2) but possible. 
-            if consecutive_failures >= 2 and i >= len(grabber_names):
-                break
-        
-        if not final_list:
-            # If nothing found, at least return Camera 0 as fallback
-            return ["Camera 0"]
-        return final_list
-
+        names = self.parent.cameras.names()
+        if not names:
+            # Scan not finished yet or nothing found: at least offer the current camera
+            return [self.parent.cameras.name_of(self.parent.settings.get("camera_index", 0))]
+        return names
 
     def refresh_cameras(self):
+        self.btn_refresh.configure(state="disabled", text="Searching...")
+        # Runs on the scan thread; hand the result back to the Tk thread
+        self.parent.cameras.refresh(lambda: self.parent.post_to_ui(self.update_camera_list))
+
+    def update_camera_list(self):
+        if not self.winfo_exists():
+            return # Window closed during the scan
+        self.btn_refresh.configure(state="normal", text="Refresh Cameras")
         self.available_cameras = self.detect_cameras()
         self.camera_menu.configure(values=self.available_cameras)
         
@@ -526,68 +607,31 @@ class PreferencesWindow(ctk.CTkToplevel):
         self.parent.settings["high_quality"] = bool(self.quality_switch.get())
         print(f"High Quality set to: {self.parent.settings['high_quality']}")
 
+    def toggle_stand(self):
+        locked = bool(self.stand_switch.get())
+        self.parent.settings["locked_geometry"] = locked
+        self.parent.captures.scanner.lock_geometry(LOCK_TOLERANCE if locked else None)
+        print(f"Locked geometry set to: {locked}")
+
     def change_filter(self, choice):
         val = self.filter_map[choice]
         self.parent.settings["scan_filter"] = val
         print(f"Filter set to: {val}")
 
+    def change_fusion(self, choice):
+        self.parent.settings["fusion"] = self.fusion_map[choice]
+        print(f"Fusion set to: {self.parent.settings['fusion']}")
+
+    def change_dedup(self, choice):
+        self.parent.settings["dedup"] = self.dedup_map[choice]
+        print(f"Repeated pages: {self.parent.settings['dedup']}")
+
     def change_camera(self, choice):
-        # Find index of choice in available_cameras
-        # Logic: We know detect_cameras builds the list in index order (0, 1, 2...)
-        # regardless of name source. So we can trust the list index matches the camera index.
-        # UNLESS there are gaps (e.g. 0 open, 1 closed, 2 open).
-        # My detect_cameras loop is sequential 0..9. 
-        # Wait, if 0 is open, 1 is closed, 2 is open.
-        # final_list = ["Name0", "Name2"] -> Index 0 of list, Index 1 of list.
-        # Actual camera indices: 0, 2.
-        # We need to map Name -> CameraIndex.
-        
-        # Better approach for change_camera: Re-derive index or store map.
-        # For simplicity, let's store a map or re-scan to match name.
-        
-        # Quick fix: The current generic logic relies on list position matching or checking "Camera X".
-        # If I have gaps, "Camera 2" might be at list index 1.
-        
-        # Let's map name to index by reconstructing the detection temporarily 
-        # OR just iterate and find which index generated this name.
-        
-        # Re-running detection logic to find index of this name:
-        target_idx = -1
-        
-        # 1. Names from pygrabber
-        grabber_names = []
-        try:
-            graph = FilterGraph()
-            grabber_names = graph.get_input_devices()
-        except: pass
-        
-        # Check if it matches a grabber name directly (and assumes index matches)
-        if choice in grabber_names:
-            target_idx = grabber_names.index(choice)
-        
-        # If not found or if we are using "Camera X" fallback
-        if target_idx == -1:
-             # Try parsing "Camera X"
-            if choice.startswith("Camera "):
-                try:
-                    target_idx = int(choice.split(" ")[1])
-                except: pass
-        
-        # If still not safe, we might have an issue where "Camera 2" is valid but python thinks index 2.
-        # But what if "Logitech" is at index 0?
-        # Let's try to trust the user selection.
-        
-        if target_idx != -1:
+        # The registry maps names back to device indices (gaps included)
+        target_idx = self.parent.cameras.index_of(choice)
+        if target_idx is not None:
             self.parent.settings["camera_index"] = target_idx
             print(f"Camera switched to index {target_idx} ({choice})")
-        else:
-             # Fallback: Assume the list order in menu matches the *available* devices, 
-             # but we need the actual hardware index.
-             # This is tricky with gaps. 
-             # Let's stick to the simplest valid assumption: 
-             # Most users have 0, 1 contiguous. 
-             # If gaps, pygrabber usually aligns with OS indices.
-             pass
 
 
 class AboutWindow(ctk.CTkToplevel):
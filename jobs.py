@@ -0,0 +1,104 @@
+import json
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueue:
+    """
+    Runs jobs on a local thread pool and keeps their state in SQLite, so any
+    worker process on the same box can answer a status poll. No broker needed.
+    """
+    def __init__(self, db_path, workers=2, max_age=24 * 3600, stale_after=10 * 60):
+        self.db_path = db_path
+        self.max_age = max_age
+        # A running job reports progress at least once per page, and a queued one waits
+        # behind at most a few compiles; one that hasn't moved for this long died with
+        # its worker process (restart, OOM kill, ...)
+        self.stale_after = stale_after
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+        db = self.connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    total INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            db.commit()
+        finally:
+            db.close()
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def execute(self, sql, params=()):
+        db = self.connect()
+        try:
+            rows = db.execute(sql, params).fetchall()
+            db.commit()
+            return rows
+        finally:
+            db.close()
+
+    def submit(self, func, total, *args):
+        """
+        Queues func(progress, *args) and returns the job id straight away.
+        func reports progress by calling progress(done) and returns a JSON-able result.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.execute("INSERT INTO jobs (id, status, total, created, updated) VALUES (?, 'queued', ?, ?, ?)",
+                     (job_id, total, now, now))
+        self.executor.submit(self.run, job_id, func, args)
+        self.prune()
+        return job_id
+
+    def run(self, job_id, func, args):
+        self.update(job_id, status="running")
+
+        def progress(done):
+            self.update(job_id, done=done)
+
+        try:
+            result = func(progress, *args)
+            self.update(job_id, status="done", result=json.dumps(result))
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self.update(job_id, status="error", error=str(e))
+
+    def update(self, job_id, **fields):
+        fields["updated"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        """
+        Returns the job as a dict, or None if it doesn't exist (or was pruned).
+        """
+        rows = self.execute("SELECT id, status, done, total, result, error, updated FROM jobs WHERE id = ?",
+                            (job_id,))
+        if not rows:
+            return None
+        job_id, status, done, total, result, error, updated = rows[0]
+        if status in ("queued", "running") and updated < time.time() - self.stale_after:
+            status, error = "error", "Job stopped responding"
+        return {
+            "id": job_id,
+            "status": status,
+            "done": done,
+            "total": total,
+            "result": json.loads(result) if result else None,
+            "error": error,
+        }
+
+    def prune(self):
+        self.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - self.max_age,))
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque, namedtuple
+import cv2
+import numpy as np
+from PIL import Image
+from tracker import QuadTracker
+
+# What the detection thread hands to the UI: the raw frame, the detected contour
+# (or None), the ready-to-show preview (PIL, RGB), the mean brightness and the
+# tracker's smoothed corner motion (fraction of the frame diagonal, or None)
+FeedResult = namedtuple("FeedResult", ["frame", "contour", "preview", "brightness", "motion"])
+
+
+class LatestFrameQueue:
+    """
+    Single slot queue where the latest item wins. put() replaces an item that
+    hasn't been consumed yet and counts it as dropped, so a slow consumer always
+    sees the newest frame instead of falling behind.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Waits up to timeout for an item. Returns None if nothing arrived.
+        """
+        with self._cond:
+            if self._item is None:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def get_nowait(self):
+        with self._cond:
+            item, self._item = self._item, None
+            return item
+
+
+class RateMeter:
+    """
+    Events per second over a sliding window.
+    """
+    def __init__(self, window=1.0):
+        self.window = window
+        self.times = deque()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        now = time.perf_counter()
+        with self._lock:
+            self.times.append(now)
+            while self.times and now - self.times[0] > self.window:
+                self.times.popleft()
+
+    @property
+    def fps(self):
+        with self._lock:
+            if len(self.times) < 2:
+                return 0.0
+            span = self.times[-1] - self.times[0]
+            return (len(self.times) - 1) / span if span > 0 else 0.0
+
+
+class LiveFeed:
+    """
+    Runs camera reads and document detection off the Tk thread:
+
+        capture thread -> frames (latest wins) -> detection thread -> results (latest wins)
+
+    The UI only polls results and renders them. The detection thread tracks the
+    document between full detections (see tracker.py). The feed owns the capture
+    once started: the capture thread releases it when it exits.
+    """
+    def __init__(self, cap, scanner, preview_size=(640, 480)):
+        self.cap = cap
+        self.scanner = scanner
+        self.tracker = QuadTracker(scanner)
+        self.preview_size = preview_size
+
+        self.frames = LatestFrameQueue()
+        self.results = LatestFrameQueue()
+        self.capture_rate = RateMeter()
+        self.detect_rate = RateMeter()
+
+        self.latest_frame = None # Newest camera frame, for manual capture
+        self.failed = False # Set when the camera stops delivering frames
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.capture_loop, name="capture", daemon=True),
+            threading.Thread(target=self.detect_loop, name="detect", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        # read() may block for a while on a stalled camera; the capture thread
+        # releases the device when it returns, so nothing else may touch it
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+
+    def stats(self):
+        """
+        Measured capture/detection rates, total frames dropped by either queue and
+        how many frames needed a full detection rather than tracking.
+        """
+        return {
+            "capture_fps": self.capture_rate.fps,
+            "detect_fps": self.detect_rate.fps,
+            "dropped": self.frames.dropped + self.results.dropped,
+            "full_detections": self.tracker.detections,
+            "tracked_frames": self.tracker.tracked_frames,
+        }
+
+    def capture_loop(self):
+        try:
+            while self.running:
+                ret, frame = self.cap.read()
+                if not ret:
+                    self.failed = True
+                    break
+                self.capture_rate.tick()
+                self.latest_frame = frame
+                self.frames.put(frame)
+        finally:
+            self.cap.release()
+
+    def detect_loop(self):
+        while self.running:
+            frame = self.frames.get(timeout=0.1)
+            if frame is None:
+                continue
+
+            doc_contour = self.tracker.update(frame)
+            self.results.put(self.build_result(frame, doc_contour, self.tracker.motion))
+            self.detect_rate.tick()
+
+    def build_result(self, frame, doc_contour, motion):
+        # Draw on a preview-sized copy so the UI thread only has to display it
+        height, width = frame.shape[:2]
+        display_frame = cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_AREA)
+
+        # Black screen check (virtual camera issue) on the small copy
+        brightness = float(np.mean(display_frame))
+
+        if doc_contour is not None:
+            scale = np.array([self.preview_size[0] / width, self.preview_size[1] / height])
+            outline = (doc_contour.reshape(-1, 1, 2) * scale).astype(np.int32)
+            cv2.drawContours(display_frame, [outline], -1, (0, 255, 0), 2)
+        preview = Image.fromarray(cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB))
+
+        return FeedResult(frame, doc_contour, preview, brightness, motion)
@@ -0,0 +1,315 @@
+import io
+import struct
+import cv2
+
+# A4 portrait in points (same page FPDF used by default)
+PAGE_WIDTH = 595.28
+PAGE_HEIGHT = 841.89
+
+# JPEG start-of-frame markers (baseline, extended, progressive, lossless, ...)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+JPEG_COLORSPACES = {1: "/DeviceGray", 3: "/DeviceRGB", 4: "/DeviceCMYK"}
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG color type -> (channels, PDF color space) for the types a PDF can take as-is
+PNG_COLORSPACES = {0: (1, "/DeviceGray"), 2: (3, "/DeviceRGB")}
+
+TIFF_SIGNATURES = (b"II*\x00", b"MM\x00*")
+# TIFF tags needed to embed a CCITT image
+TIFF_WIDTH, TIFF_HEIGHT, TIFF_BITS, TIFF_COMPRESSION, TIFF_PHOTOMETRIC = 256, 257, 258, 259, 262
+TIFF_FILL_ORDER, TIFF_STRIP_OFFSETS, TIFF_ROWS_PER_STRIP, TIFF_STRIP_BYTES = 266, 273, 278, 279
+TIFF_TAGS = {TIFF_WIDTH, TIFF_HEIGHT, TIFF_BITS, TIFF_COMPRESSION, TIFF_PHOTOMETRIC,
+             TIFF_FILL_ORDER, TIFF_STRIP_OFFSETS, TIFF_ROWS_PER_STRIP, TIFF_STRIP_BYTES}
+TIFF_TYPE_SIZES = {1: 1, 3: 2, 4: 4} # BYTE, SHORT, LONG
+TIFF_GROUP4 = 4
+
+
+def jpeg_info(data):
+    """
+    Reads width, height and number of components from the JPEG frame header.
+    """
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("Not a JPEG file")
+
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            raise ValueError("Corrupt JPEG marker")
+        marker = data[i + 1]
+        i += 2
+        if marker == 0xFF:
+            # Fill byte, the marker follows
+            i -= 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Markers without a length field
+            continue
+
+        length = int.from_bytes(data[i:i + 2], "big")
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[i + 3:i + 5], "big")
+            width = int.from_bytes(data[i + 5:i + 7], "big")
+            components = data[i + 7]
+            return width, height, components
+        i += length
+
+    raise ValueError("No JPEG frame header found")
+
+
+def png_info(data):
+    """
+    Reads the header of a PNG and collects its compressed image data.
+    Returns (width, height, bit_depth, color_type, interlaced, idat).
+    """
+    width = height = depth = color_type = interlace = None
+    idat = []
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if kind == b"IHDR":
+            width, height, depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", body)
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+        pos += length + 12 # Length, type, data, CRC
+
+    if width is None:
+        raise ValueError("No PNG header found")
+    return width, height, depth, color_type, bool(interlace), b"".join(idat)
+
+
+def tiff_info(data):
+    """
+    Reads the tags of the first TIFF page needed to embed it (see TIFF_TAGS).
+    Returns {tag: [values]}.
+    """
+    order = "<" if data[:2] == b"II" else ">"
+    ifd = struct.unpack(order + "I", data[4:8])[0]
+    count = struct.unpack(order + "H", data[ifd:ifd + 2])[0]
+
+    tags = {}
+    for i in range(count):
+        entry = ifd + 2 + 12 * i
+        tag, kind, n = struct.unpack(order + "HHI", data[entry:entry + 8])
+        if tag not in TIFF_TAGS or kind not in TIFF_TYPE_SIZES:
+            continue
+        size = TIFF_TYPE_SIZES[kind]
+        # Values that fit in 4 bytes are stored in the entry itself
+        offset = entry + 8 if size * n <= 4 else struct.unpack(order + "I", data[entry + 8:entry + 12])[0]
+        fmt = order + {1: "B", 2: "H", 4: "I"}[size] * n
+        tags[tag] = list(struct.unpack(fmt, data[offset:offset + size * n]))
+    return tags
+
+
+class PDFWriter:
+    """
+    Writes a PDF one page at a time. Each image is written out as soon as it is
+    added and only object offsets are kept until close(), so memory stays flat no
+    matter how many pages there are. JPEG files are embedded as-is (DCTDecode),
+    as are gray/RGB PNGs (their zlib data with PNG predictors, FlateDecode) and
+    Group 4 TIFFs (CCITTFaxDecode, one image per strip).
+    """
+    def __init__(self, fileobj, page_width=PAGE_WIDTH, page_height=PAGE_HEIGHT):
+        self.fileobj = fileobj
+        self.page_width = page_width
+        self.page_height = page_height
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        # 1 = catalog, 2 = page tree; both are written at close()
+        self.next_id = 3
+        self.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self.page_ids)
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def new_id(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def write_object(self, obj_id, body):
+        self.offsets[obj_id] = self.position
+        self.write(f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def write_stream(self, obj_id, dictionary, data):
+        self.offsets[obj_id] = self.position
+        self.write(f"{obj_id} 0 obj\n<< {dictionary} /Length {len(data)} >>\nstream\n".encode("latin-1"))
+        self.write(data)
+        self.write(b"\nendstream\nendobj\n")
+
+    def add_image_file(self, path):
+        """
+        Adds a page showing the image at path. JPEGs, PNGs and Group 4 TIFFs are
+        embedded without decoding where possible, anything else is converted to
+        JPEG first.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        if data[:2] == b"\xff\xd8":
+            return self.add_jpeg(data)
+        if data[:8] == PNG_SIGNATURE and self.add_png(data):
+            return
+        if data[:4] in TIFF_SIGNATURES and self.add_group4_tiff(data):
+            return
+
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"Could not read image: {path}")
+        self.add_jpeg(cv2.imencode(".jpg", image)[1].tobytes())
+
+    def add_jpeg(self, data):
+        """
+        Adds a page showing an encoded JPEG image.
+        """
+        width, height, components = jpeg_info(data)
+        if components not in JPEG_COLORSPACES:
+            raise ValueError(f"Unsupported JPEG with {components} components")
+
+        image_id = self.new_id()
+        self.write_stream(image_id,
+                          f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                          f"/ColorSpace {JPEG_COLORSPACES[components]} /BitsPerComponent 8 /Filter /DCTDecode",
+                          data)
+        self.add_page(image_id, width, height)
+
+    def add_png(self, data):
+        """
+        Adds a page showing an encoded PNG image. Returns False (and writes
+        nothing) for PNGs that need decoding: palette, alpha, interlaced, 16 bit.
+        """
+        width, height, depth, color_type, interlaced, idat = png_info(data)
+        if color_type not in PNG_COLORSPACES or interlaced or depth > 8:
+            return False
+
+        # PNG's zlib stream with per-row filters is exactly Flate with PNG predictors
+        colors, colorspace = PNG_COLORSPACES[color_type]
+        image_id = self.new_id()
+        self.write_stream(image_id,
+                          f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                          f"/ColorSpace {colorspace} /BitsPerComponent {depth} /Filter /FlateDecode "
+                          f"/DecodeParms << /Predictor 15 /Colors {colors} /BitsPerComponent {depth} /Columns {width} >>",
+                          idat)
+        self.add_page(image_id, width, height)
+        return True
+
+    def add_group4_tiff(self, data):
+        """
+        Adds a page showing a CCITT Group 4 TIFF, one image per strip. Returns
+        False (and writes nothing) for other TIFFs.
+        """
+        tags = tiff_info(data)
+        if (tags.get(TIFF_COMPRESSION) != [TIFF_GROUP4] or tags.get(TIFF_BITS, [1]) != [1]
+                or tags.get(TIFF_FILL_ORDER, [1]) != [1] or TIFF_STRIP_OFFSETS not in tags):
+            return False
+
+        width = tags[TIFF_WIDTH][0]
+        height = tags[TIFF_HEIGHT][0]
+        rows_per_strip = tags.get(TIFF_ROWS_PER_STRIP, [height])[0]
+        # Photometric 1 (BlackIsZero) stores black as 0 bits, which the codec calls white
+        black_is_1 = "true" if tags.get(TIFF_PHOTOMETRIC) == [1] else "false"
+
+        strips = []
+        for i, (offset, length) in enumerate(zip(tags[TIFF_STRIP_OFFSETS], tags[TIFF_STRIP_BYTES])):
+            rows = min(rows_per_strip, height - i * rows_per_strip)
+            image_id = self.new_id()
+            self.write_stream(image_id,
+                              f"/Type /XObject /Subtype /Image /Width {width} /Height {rows} "
+                              f"/ColorSpace /DeviceGray /BitsPerComponent 1 /Filter /CCITTFaxDecode "
+                              f"/DecodeParms << /K -1 /Columns {width} /Rows {rows} /BlackIs1 {black_is_1} >>",
+                              data[offset:offset + length])
+            strips.append((image_id, rows))
+        self.add_strips(strips, width, height)
+        return True
+
+    def add_page(self, image_id, width, height):
+        self.add_strips([(image_id, height)], width, height)
+
+    def add_strips(self, strips, width, height):
+        """
+        Adds a page showing an image made of horizontal strips, given top to bottom
+        as (image id, rows).
+        """
+        # Fit to page width, top aligned (like FPDF's image(x=0, y=0, w=210))
+        draw_w = self.page_width
+        scale = draw_w / width
+
+        commands = []
+        resources = []
+        top = self.page_height
+        for i, (image_id, rows) in enumerate(strips):
+            draw_h = rows * scale
+            top -= draw_h
+            commands.append(f"q {draw_w:.2f} 0 0 {draw_h:.4f} 0 {top:.4f} cm /Im{i} Do Q")
+            resources.append(f"/Im{i} {image_id} 0 R")
+
+        content_id = self.new_id()
+        self.write_stream(content_id, "", "\n".join(commands).encode("latin-1"))
+
+        page_id = self.new_id()
+        self.write_object(page_id,
+                          f"<< /Type /Page /Parent 2 0 R "
+                          f"/MediaBox [0 0 {self.page_width:.2f} {self.page_height:.2f}] "
+                          f"/Resources << /XObject << {' '.join(resources)} >> >> "
+                          f"/Contents {content_id} 0 R >>")
+        self.page_ids.append(page_id)
+
+    def close(self):
+        """
+        Writes the page tree, catalog and cross-reference table.
+        """
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self.write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self.write_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_start = self.position
+        size = self.next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for obj_id in range(1, size):
+            lines.append(f"{self.offsets[obj_id]:010d} 00000 n \n")
+        lines.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_start}\n%%EOF\n")
+        self.write("".join(lines).encode("latin-1"))
+
+
+def write_pdf(image_paths, output_path, progress=None):
+    """
+    Compiles the images into a PDF file, one page per image.
+    progress, if given, is called with the number of pages written so far.
+    """
+    with open(output_path, "wb") as f:
+        writer = PDFWriter(f)
+        for path in image_paths:
+            writer.add_image_file(path)
+            if progress:
+                progress(writer.page_count)
+        writer.close()
+
+
+def stream_pdf(image_paths):
+    """
+    Yields the PDF for the images in chunks, one per page, for streaming responses.
+    """
+    buf = io.BytesIO()
+    writer = PDFWriter(buf)
+    yield drain(buf)
+    for path in image_paths:
+        writer.add_image_file(path)
+        yield drain(buf)
+    writer.close()
+    yield drain(buf)
+
+
+def drain(buf):
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
@@ -0,0 +1,107 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+# Longest side in pixels. 320 covers the web gallery tiles on high-DPI screens,
+# 600 the desktop preview pane.
+PREVIEW_SIZES = (320, 600)
+
+
+class PreviewStore:
+    """
+    Downscaled JPEG copies of saved scans, written once per scan by a background
+    thread so neither the request nor the UI waits for them.
+
+    Previews live in <directory>/<size>/<scan name>.jpg. Sizes are produced
+    largest first, each resized from the previous one, so only the first resize
+    touches the full resolution page.
+    """
+    def __init__(self, directory, sizes=PREVIEW_SIZES, quality=80, workers=1):
+        self.directory = directory
+        self.sizes = tuple(sorted(sizes, reverse=True))
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="previews")
+        self.pending = {} # Source path -> Future of a job not finished yet
+        self.lock = threading.Lock()
+
+        for size in self.sizes:
+            os.makedirs(self.size_dir(size), exist_ok=True)
+
+    def size_dir(self, size):
+        return os.path.join(self.directory, str(size))
+
+    def path(self, source, size):
+        name = os.path.splitext(os.path.basename(source))[0]
+        return os.path.join(self.size_dir(size), f"{name}.jpg")
+
+    def submit(self, source, image=None):
+        """
+        Queues preview generation for a saved scan. Pass the image when it's still
+        in memory to skip decoding the file again. Returns a Future of {size: path}.
+        """
+        with self.lock:
+            future = self.pending.get(source)
+            if future is None:
+                future = self.executor.submit(self.run, source, image)
+                self.pending[source] = future
+        return future
+
+    def run(self, source, image):
+        try:
+            return self.generate(source, image)
+        finally:
+            with self.lock:
+                self.pending.pop(source, None)
+
+    def generate(self, source, image=None):
+        if image is None:
+            image = cv2.imread(source, cv2.IMREAD_COLOR)
+            if image is None:
+                raise FileNotFoundError(source)
+
+        paths = {}
+        for size in self.sizes:
+            h, w = image.shape[:2]
+            scale = size / max(h, w)
+            if scale < 1.0:
+                image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))),
+                                   interpolation=cv2.INTER_AREA)
+
+            path = self.path(source, size)
+            # Write then rename, so a reader never sees a half written file
+            partial = path + ".part.jpg"
+            cv2.imwrite(partial, image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            os.replace(partial, path)
+            paths[size] = path
+        return paths
+
+    def get(self, source, size):
+        """
+        Returns the preview path for a scan, waiting for a queued job or generating
+        it now if it's missing (e.g. scans from before a restart). None if the scan
+        itself doesn't exist.
+        """
+        path = self.path(source, size)
+        if os.path.exists(path):
+            return path
+        if not os.path.exists(source):
+            return None
+        try:
+            return self.submit(source).result()[size]
+        except FileNotFoundError:
+            return None
+
+    def discard(self, source):
+        """
+        Deletes the previews of a scan that was removed. Returns the deleted paths.
+        """
+        deleted = []
+        for size in self.sizes:
+            path = self.path(source, size)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            deleted.append(path)
+        return deleted
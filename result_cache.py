@@ -0,0 +1,86 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+
+CacheEntry = namedtuple("CacheEntry", ["path", "size", "info"])
+
+
+def image_key(image, *parts):
+    """
+    Content hash of decoded pixels plus extra parts (e.g. scanner settings).
+    Identical frames give the same key however they were encoded or uploaded.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.shape}{image.dtype}".encode())
+    h.update(memoryview(np.ascontiguousarray(image)).cast("B"))
+    for part in parts:
+        h.update(b"\0")
+        h.update(str(part).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU index of processed scans. Each entry points at an output file on disk plus
+    a small info dict returned on a hit. The number of entries (memory) and the
+    total size of their files (disk) are both bounded. Evicting an entry only
+    drops it from the index; whether its file goes too is up to on_evict, since
+    files handed out to clients must outlive the cache.
+    """
+    def __init__(self, max_entries=10000, max_bytes=512 * 1024 * 1024, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict # Called with the path of every evicted entry
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the entry for key (marking it recently used), or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry.path):
+                # Deleted behind our back (cleanup, manual removal)
+                self.remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, path, info):
+        size = os.path.getsize(path)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = CacheEntry(path, size, info)
+            self.total_bytes += size
+            evicted = self.evict()
+
+        if self.on_evict:
+            for old in evicted:
+                self.on_evict(old.path)
+
+    def discard_path(self, path):
+        """
+        Forgets entries pointing at a file that was deleted elsewhere.
+        """
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry.path == path]:
+                self.remove(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+        return entry
+
+    def evict(self):
+        evicted = []
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            key = next(iter(self.entries))
+            evicted.append(self.remove(key))
+        return evicted
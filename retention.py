@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class FileRecord:
+    __slots__ = ("size", "last_used", "sessions")
+
+    def __init__(self, size, last_used, sessions=()):
+        self.size = size
+        self.last_used = last_used
+        self.sessions = set(sessions)
+
+
+class RetentionManager:
+    """
+    Keeps generated files under a TTL and a total size quota.
+
+    Files are recorded in an in-memory index as they are written (plus a single
+    directory scan at startup), ordered from least to most recently used, so a
+    sweep only walks the expired end of the index and never lists the
+    directories again. Each file remembers the sessions that produced or reused
+    it, so a session can be cleaned up without touching other sessions' pages.
+
+    With sessions_path, the file <-> session pairs are also appended to a JSON
+    lines log and read back by load(), so they survive a restart. compact
+    rewrites the log at startup without the lines of deleted files; leave it off
+    in processes that only read (e.g. batch pool workers).
+    """
+    def __init__(self, directories, ttl=24 * 3600, max_bytes=2 * 1024 ** 3, interval=300,
+                 sessions_path=None, compact=True):
+        self.directories = directories
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.sessions_path = sessions_path
+        self.on_delete = [] # Callbacks run with the path of every deleted file
+
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.load()
+        if sessions_path and compact:
+            self.compact_sessions()
+
+    def load(self):
+        """
+        Indexes files already on disk (e.g. from before a restart), oldest first,
+        with their sessions from the log.
+        """
+        found = []
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if entry.is_file():
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.path, stat.st_size))
+
+        with self.lock:
+            for mtime, path, size in sorted(found):
+                self.index[path] = FileRecord(size, mtime)
+                self.total_bytes += size
+
+            for entry in self.read_sessions():
+                record = self.index.get(entry["path"])
+                if record is None:
+                    continue
+                if "session" not in entry:
+                    record.sessions.clear() # File was deleted (later lines: a new file)
+                elif entry.get("removed"):
+                    record.sessions.discard(entry["session"])
+                else:
+                    record.sessions.add(entry["session"])
+
+    def read_sessions(self):
+        if not self.sessions_path:
+            return []
+        entries = []
+        try:
+            with open(self.sessions_path, "rb") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue # Torn last line
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def log_session(self, entry):
+        # Called with the lock held, so lines are written in the order applied
+        if self.sessions_path:
+            with open(self.sessions_path, "ab") as f:
+                f.write((json.dumps(entry) + "\n").encode())
+
+    def compact_sessions(self):
+        """
+        Rewrites the session log with one line per current file <-> session pair.
+        """
+        with self.lock:
+            lines = [json.dumps({"path": path, "session": session}) + "\n"
+                     for path, record in self.index.items() for session in sorted(record.sessions)]
+            partial_path = self.sessions_path + ".part"
+            with open(partial_path, "w") as f:
+                f.writelines(lines)
+            os.replace(partial_path, self.sessions_path)
+
+    def track(self, path, session=None):
+        """
+        Records a file that was written or reused, marking it as recently used.
+        """
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+
+        with self.lock:
+            record = self.index.get(path)
+            if record is None:
+                record = self.index[path] = FileRecord(size, time.time())
+            else:
+                self.total_bytes -= record.size
+                record.size = size
+                record.last_used = time.time()
+                self.index.move_to_end(path)
+            self.total_bytes += size
+            if session and session not in record.sessions:
+                record.sessions.add(session)
+                self.log_session({"path": path, "session": session})
+
+    def sessions(self, path):
+        """
+        Sessions that produced or reused a file (empty if it isn't tracked).
+        """
+        with self.lock:
+            record = self.index.get(path)
+            return set(record.sessions) if record else set()
+
+    def forget(self, path):
+        """
+        Drops a file that was deleted by someone else (e.g. cache eviction).
+        """
+        with self.lock:
+            record = self.index.pop(path, None)
+            if record is not None:
+                self.total_bytes -= record.size
+                if record.sessions:
+                    self.log_session({"path": path})
+
+    def sweep(self):
+        """
+        Deletes files past the TTL, then the least recently used ones until the
+        total is under quota. Returns (files deleted, bytes reclaimed).
+        """
+        cutoff = time.time() - self.ttl
+        victims = []
+        with self.lock:
+            while self.index:
+                path, record = next(iter(self.index.items()))
+                if record.last_used >= cutoff and self.total_bytes <= self.max_bytes:
+                    break
+                victims.append(self.pop(path))
+        return self.delete(victims)
+
+    def delete_session(self, session):
+        """
+        Deletes the files of one session, except ones another session also uses.
+        Returns (files deleted, bytes reclaimed).
+        """
+        victims = []
+        with self.lock:
+            for path, record in list(self.index.items()):
+                if session in record.sessions:
+                    record.sessions.discard(session)
+                    if not record.sessions:
+                        victims.append(self.pop(path))
+                    else:
+                        self.log_session({"path": path, "session": session, "removed": True})
+        return self.delete(victims)
+
+    def pop(self, path):
+        record = self.index.pop(path)
+        self.total_bytes -= record.size
+        if record.sessions:
+            self.log_session({"path": path})
+        return path, record
+
+    def delete(self, victims):
+        deleted = 0
+        reclaimed = 0
+        for path, record in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"Retention: could not delete {path}: {e}")
+                continue
+            deleted += 1
+            reclaimed += record.size
+            for callback in self.on_delete:
+                callback(path)
+        return deleted, reclaimed
+
+    def start(self):
+        """
+        Starts the background sweeper thread.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="retention", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                deleted, reclaimed = self.sweep()
+                if deleted:
+                    print(f"Retention: deleted {deleted} files, reclaimed {reclaimed} bytes")
+            except Exception as e:
+                print(f"Retention sweep failed: {e}")
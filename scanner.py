@@ -1,59 +1,206 @@
 import cv2
 import numpy as np
+from contextlib import contextmanager, nullcontext
+from warp_maps import WarpMapCache, LOCK_TOLERANCE
+
+# Shared no-op context, so stage() costs next to nothing when profiling is off
+NO_PROFILE = nullcontext()
+
+FILTER_TYPES = ("bw", "gray", "original")
+
+# Adaptive threshold settings for the "bw" filter
+BW_BLOCK_SIZE = 11
+BW_C = 2
+
+# Sharpness is measured on the page area downscaled to this longest side
+SHARPNESS_MAX_SIDE = 480
+
+@contextmanager
+def opencv_threads(count):
+    """
+    Temporarily sets OpenCV's thread count. The setting is process wide, so
+    concurrent callers with different counts will see each other's value.
+    """
+    if count is None:
+        yield
+        return
+    previous = cv2.getNumThreads()
+    cv2.setNumThreads(count)
+    try:
+        yield
+    finally:
+        cv2.setNumThreads(previous)
 
 class DocumentScanner:
-    def __init__(self):
-        pass
+    def __init__(self, detect_max_side=None, refine_corners=False, profiler=None, lock_tolerance=None):
+        """
+        detect_max_side: if set, detection runs on a copy of the frame downscaled so
+        its longest side is at most this many pixels. The corners are scaled back to
+        full resolution, so warping still uses the original pixels.
+        refine_corners: refine the rescaled corners with a sub-pixel corner search on
+        the full resolution image.
+        profiler: optional object whose stage(name) returns a context manager timing
+        that stage (see metrics.StageProfiler).
+        lock_tolerance: "locked geometry" for cameras on a fixed stand. Warps reuse
+        cached remap tables while the corners stay within this many pixels (see
+        warp_maps.WarpMapCache). None warps every page from scratch.
+        """
+        self.detect_max_side = detect_max_side
+        self.refine_corners = refine_corners
+        self.profiler = profiler
+        self.lock_geometry(lock_tolerance)
+
+    def lock_geometry(self, tolerance=LOCK_TOLERANCE):
+        """
+        Turns locked geometry on (tolerance in pixels) or off (None).
+        """
+        self.lock_tolerance = tolerance
+        self.warp_maps = WarpMapCache(self.page_size, tolerance) if tolerance else None
+
+    def settings(self):
+        """
+        Parameters that change the pipeline output (e.g. for cache keys).
+        """
+        return {"detect_max_side": self.detect_max_side, "refine_corners": self.refine_corners,
+                "lock_tolerance": self.lock_tolerance}
+
+    def stage(self, name):
+        """
+        Context manager timing one pipeline stage with the profiler, if any.
+        """
+        if self.profiler is None:
+            return NO_PROFILE
+        return self.profiler.stage(name)
 
     def detect_document(self, frame):
         """
         Detects the largest quadrilateral in the frame.
         Returns the contour of the document and the processed frame (for debug).
+        With detect_max_side set, the edge map is the downscaled one and the contour
+        is in full resolution coordinates (float32 when refine_corners is on).
         """
         # 1. Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
+        with self.stage("gray"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        # Downscale for detection (pyramid mode)
+        scale = self.detection_scale(gray.shape)
+        small = gray
+        if scale < 1.0:
+            with self.stage("resize"):
+                small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        doc_contour, edged = self.find_quad(small)
+
+        if doc_contour is not None and scale < 1.0:
+            corners = doc_contour.astype("float32") / scale
+            if self.refine_corners:
+                with self.stage("refine"):
+                    corners = self.refine_quad(gray, corners, scale)
+                doc_contour = corners
+            else:
+                doc_contour = np.round(corners).astype("int32")
+
+        return doc_contour, edged
+
+    def detection_scale(self, shape):
+        """
+        Returns the factor used to downscale a frame of this shape for detection.
+        """
+        if not self.detect_max_side:
+            return 1.0
+        longest = max(shape[0], shape[1])
+        if longest <= self.detect_max_side:
+            return 1.0
+        return self.detect_max_side / float(longest)
+
+    def refine_quad(self, gray, corners, scale):
+        """
+        Refines rescaled corners with a sub-pixel search on the full resolution image.
+        The search window covers the error introduced by downscaling.
+        """
+        win = max(3, int(round(1.0 / scale)) * 2)
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.1)
+        original = corners.reshape(4, 1, 2).astype("float32")
+        refined = original.copy()
+        cv2.cornerSubPix(gray, refined, (win, win), (-1, -1), criteria)
+
+        # Keep the original corner if the search wandered off (e.g. a blurry edge)
+        moved = np.linalg.norm(refined - original, axis=2)[:, 0] > win
+        refined[moved] = original[moved]
+        return refined
+
+    def find_quad(self, gray):
+        """
+        Runs blur, edge detection and contour search on a grayscale image.
+        Returns the 4 point contour (or None) and the edge map.
+        """
         # 2. Blur to remove noise
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        with self.stage("blur"):
+            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         
         # 3. Edge Detection
-        edged = cv2.Canny(blurred, 75, 200)
+        with self.stage("canny"):
+            edged = cv2.Canny(blurred, 75, 200)
         
         # 4. Find Contours
-        contours, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
+        with self.stage("contours"):
+            contours, _ = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+            contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
         
         doc_contour = None
         
-        for c in contours:
-            # Approximate the contour
-            peri = cv2.arcLength(c, True)
-            approx = cv2.approxPolyDP(c, 0.02 * peri, True)
-            
-            # If our approximated contour has 4 points, we can assume we found the screen/paper
-            if len(approx) == 4:
-                doc_contour = approx
-                break
+        with self.stage("approx"):
+            for c in contours:
+                # Approximate the contour
+                peri = cv2.arcLength(c, True)
+                approx = cv2.approxPolyDP(c, 0.02 * peri, True)
+
+                # If our approximated contour has 4 points, we can assume we found the screen/paper
+                if len(approx) == 4:
+                    doc_contour = approx
+                    break
                 
         return doc_contour, edged
 
-    def get_perspective_transform(self, image, pts):
+    def sharpness(self, image, contour=None, max_side=SHARPNESS_MAX_SIDE):
+        """
+        Focus measure: variance of the Laplacian over the page's bounding box (or
+        the whole image), on a downscaled copy. Higher is sharper. Only meaningful
+        when comparing frames of the same scene, e.g. a burst of one page.
+        """
+        with self.stage("sharpness"):
+            roi = image
+            if contour is not None:
+                x, y, w, h = cv2.boundingRect(contour.reshape(-1, 2).astype(np.float32))
+                x, y = max(x, 0), max(y, 0)
+                roi = image[y:y + h, x:x + w]
+                if roi.size == 0:
+                    roi = image
+
+            gray = self.to_gray(roi)
+            scale = max_side / max(gray.shape[:2])
+            if scale < 1.0:
+                gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            return cv2.Laplacian(gray, cv2.CV_32F).var()
+
+    def get_perspective_transform(self, image, pts, size=None, out=None):
         """
         Unwarps the detected document to a flat top-down view.
+        size: (width, height) of the result; by default the quad's own (see page_size).
+        out: optional array of that size to write the result into.
         """
         # Order points: top-left, top-right, bottom-right, bottom-left
         rect = self.order_points(pts.reshape(4, 2))
-        (tl, tr, br, bl) = rect
 
-        # Compute width of new image
-        widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
-        widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
-        maxWidth = max(int(widthA), int(widthB))
+        # Locked geometry: same quad as a recent page, reuse its maps (and size)
+        warp_maps = self.warp_maps
+        if warp_maps is not None:
+            with self.stage("warp"):
+                map1, map2, size = warp_maps.lookup(rect, image.shape, size)
+                return cv2.remap(image, map1, map2, cv2.INTER_LINEAR, dst=out)
 
-        # Compute height of new image
-        heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
-        heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
-        maxHeight = max(int(heightA), int(heightB))
+        maxWidth, maxHeight = size or self.page_size(rect)
 
         # Construct destination points
         dst = np.array([
@@ -63,11 +210,31 @@ class DocumentScanner:
             [0, maxHeight - 1]], dtype="float32")
 
         # Compute perspective transform matrix
-        M = cv2.getPerspectiveTransform(rect, dst)
-        warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight))
+        with self.stage("warp"):
+            M = cv2.getPerspectiveTransform(rect, dst)
+            warped = cv2.warpPerspective(image, M, (maxWidth, maxHeight), dst=out)
 
         return warped
 
+    def page_size(self, rect):
+        """
+        Output (width, height) for a quad ordered by order_points: its longest
+        top/bottom and left/right sides.
+        """
+        (tl, tr, br, bl) = rect
+
+        # Compute width of new image
+        widthA = np.sqrt(((br[0] - bl[0]) ** 2) + ((br[1] - bl[1]) ** 2))
+        widthB = np.sqrt(((tr[0] - tl[0]) ** 2) + ((tr[1] - tl[1]) ** 2))
+        maxWidth = max(int(widthA), int(widthB))
+
+        # Compute height of new image
+        heightA = np.sqrt(((tr[0] - br[0]) ** 2) + ((tr[1] - br[1]) ** 2))
+        heightB = np.sqrt(((tl[0] - bl[0]) ** 2) + ((tl[1] - bl[1]) ** 2))
+        maxHeight = max(int(heightA), int(heightB))
+
+        return maxWidth, maxHeight
+
     def order_points(self, pts):
         """
         Orders coordinates: top-left, top-right, bottom-right, bottom-left
@@ -88,13 +255,99 @@ class DocumentScanner:
         """
         Applies filters to look like a scan.
         """
-        if filter_type == "bw":
-            # Adaptive thresholding for "Xerox" look
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            # T = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1] # Simple
-            T = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
-            return T
-        elif filter_type == "gray":
-            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        else:
+        with self.stage("filter"):
+            if filter_type == "bw":
+                # Adaptive thresholding for "Xerox" look
+                gray = self.to_gray(image)
+                # T = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)[1] # Simple
+                T = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, BW_BLOCK_SIZE, BW_C)
+                return T
+            elif filter_type == "gray":
+                return self.to_gray(image)
+            else:
+                return image
+
+    def to_gray(self, image, dst=None):
+        """
+        Grayscale view of a page; pages that are already gray are returned as-is.
+        """
+        if image.ndim == 2:
             return image
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
+
+    def apply_filter_batch(self, images, filter_type="bw", threads=None, outputs=None):
+        """
+        Applies one filter to a list of pages.
+        threads: OpenCV thread count for this call (None keeps the current one).
+        outputs: optional arrays from an earlier call to write the results into
+        (reused when the shape matches, so repeated batches don't reallocate).
+        The grayscale buffer for "bw" is shared between pages of the same size.
+        """
+        results = []
+        gray_buffers = {}
+        with opencv_threads(threads), self.stage("filter"):
+            for i, image in enumerate(images):
+                out = outputs[i] if outputs is not None and i < len(outputs) else None
+                if filter_type not in ("bw", "gray"):
+                    results.append(image)
+                    continue
+
+                if out is not None and out.shape != image.shape[:2]:
+                    out = None
+
+                if filter_type == "gray":
+                    results.append(self.to_gray(image, dst=out))
+                    continue
+
+                shape = image.shape[:2]
+                if image.ndim == 3:
+                    if shape not in gray_buffers:
+                        gray_buffers[shape] = np.empty(shape, np.uint8)
+                    gray = self.to_gray(image, dst=gray_buffers[shape])
+                else:
+                    gray = image
+                results.append(cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+                                                     BW_BLOCK_SIZE, BW_C, dst=out))
+        return results
+
+    def filter_variants(self, image, variants=FILTER_TYPES, threads=None):
+        """
+        Produces several filter variants of one page from a single grayscale pass.
+        Returns a dict of filter type -> image.
+        """
+        results = {}
+        with opencv_threads(threads), self.stage("filter"):
+            gray = None
+            for filter_type in variants:
+                if filter_type not in ("bw", "gray"):
+                    results[filter_type] = image
+                    continue
+                if gray is None:
+                    gray = self.to_gray(image)
+                if filter_type == "gray":
+                    results[filter_type] = gray
+                else:
+                    results[filter_type] = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                                                 cv2.THRESH_BINARY, BW_BLOCK_SIZE, BW_C)
+        return results
+
+    def warp_document(self, frame):
+        """
+        Detects the document and warps it flat (unfiltered).
+        Returns the page (the whole frame if nothing was found) and whether a
+        document was detected.
+        """
+        doc_contour, _ = self.detect_document(frame)
+
+        # Warp or use original
+        if doc_contour is not None:
+            return self.get_perspective_transform(frame, doc_contour.reshape(4, 2)), True
+        return frame, False
+
+    def scan(self, frame, filter_type="bw"):
+        """
+        Full pipeline: detect, warp (if a document was found) and filter.
+        Returns the final image and whether a document was detected.
+        """
+        processed_frame, detected = self.warp_document(frame)
+        return self.apply_filter(processed_frame, filter_type=filter_type), detected
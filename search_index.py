@@ -0,0 +1,237 @@
+import bisect
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MIN_TOKEN_LENGTH = 2
+
+
+def tokenize(text):
+    return {token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) >= MIN_TOKEN_LENGTH}
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def ocr_available():
+    return shutil.which("tesseract") is not None
+
+
+def run_ocr(path, timeout=60):
+    """
+    Text of an image via the locally installed Tesseract command line tool.
+    """
+    result = subprocess.run(["tesseract", path, "stdout"], capture_output=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode(errors="replace").strip() or "tesseract failed")
+    return result.stdout.decode(errors="replace")
+
+
+class SearchIndex:
+    """
+    Inverted index from words to pages, kept in memory and persisted as an
+    append-only JSON lines log (one line per added or removed page), so adding
+    a page never rewrites the file.
+
+    Lookups never touch the images: a query word matches every indexed word it
+    is a prefix of (binary search over the sorted vocabulary) or a substring of
+    (words sharing all its trigrams). Several query words must all match.
+
+    Other processes appending to the same file (e.g. gunicorn workers) are
+    picked up on the next search by reading the log from where we left off.
+    """
+    def __init__(self, path, compact=True):
+        self.path = path
+        self.lock = threading.Lock()
+        self.reset()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.refresh()
+        if compact and self.dead_lines > len(self.pages):
+            self.compact()
+
+    def reset(self):
+        self.offset = 0 # Bytes of the log already applied
+        self.dead_lines = 0
+        self.pages = {} # Page id -> tokens
+        self.postings = {} # Token -> page ids
+        self.vocabulary = [] # Sorted tokens, for prefix search
+        self.trigram_tokens = {} # Trigram -> tokens, for substring search
+
+    def refresh(self):
+        """
+        Applies log lines appended since the last call (by us or other processes).
+        """
+        with self.lock:
+            try:
+                with open(self.path, "rb") as f:
+                    if os.fstat(f.fileno()).st_size < self.offset:
+                        # Compacted by another process: start over
+                        self.reset()
+                    f.seek(self.offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            # Only whole lines; a line still being written is picked up next time
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["page"] in self.pages:
+                    self.dead_lines += 1
+                self.apply(entry)
+            self.offset += end
+
+    def apply(self, entry):
+        page = entry["page"]
+        self.unlink(page)
+        if "tokens" in entry:
+            tokens = set(entry["tokens"])
+            self.pages[page] = tokens
+            for token in tokens:
+                pages = self.postings.get(token)
+                if pages is None:
+                    pages = self.postings[token] = set()
+                    bisect.insort(self.vocabulary, token)
+                    for gram in trigrams(token):
+                        self.trigram_tokens.setdefault(gram, set()).add(token)
+                pages.add(page)
+        else:
+            self.dead_lines += 1
+
+    def unlink(self, page):
+        # Drops a page's postings; words no page uses any more stay in the vocabulary
+        for token in self.pages.pop(page, ()):
+            self.postings[token].discard(page)
+
+    def append(self, entry):
+        self.refresh()
+        line = (json.dumps(entry) + "\n").encode()
+        with self.lock:
+            with open(self.path, "ab") as f:
+                f.write(line)
+                # Lines we append ourselves are applied directly (unless another
+                # process wrote in between, then refresh() catches up first)
+                if f.tell() == self.offset + len(line):
+                    self.offset += len(line)
+                    if entry["page"] in self.pages:
+                        self.dead_lines += 1
+                    self.apply(entry)
+                    return
+        self.refresh()
+
+    def add(self, page, text):
+        """
+        Indexes (or re-indexes) a page from its text.
+        """
+        self.append({"page": page, "tokens": sorted(tokenize(text))})
+
+    def remove(self, page):
+        if page in self.pages:
+            self.append({"page": page, "deleted": True})
+
+    def __contains__(self, page):
+        return page in self.pages
+
+    def search(self, query):
+        """
+        Pages matching every word of the query by prefix or substring.
+        """
+        self.refresh()
+        words = TOKEN_PATTERN.findall(query.lower())
+        if not words:
+            return set()
+
+        with self.lock:
+            result = None
+            for word in words:
+                pages = set()
+                for token in self.matching_tokens(word):
+                    pages |= self.postings[token]
+                result = pages if result is None else result & pages
+                if not result:
+                    break
+            return result
+
+    def matching_tokens(self, word):
+        # Prefix matches: a contiguous run of the sorted vocabulary
+        start = bisect.bisect_left(self.vocabulary, word)
+        end = bisect.bisect_left(self.vocabulary, word + "\U0010ffff")
+        tokens = set(self.vocabulary[start:end])
+
+        # Substring matches: candidates share every trigram of the word
+        if len(word) >= 3:
+            candidates = None
+            for gram in trigrams(word):
+                found = self.trigram_tokens.get(gram, set())
+                candidates = found if candidates is None else candidates & found
+                if not candidates:
+                    break
+            tokens.update(token for token in candidates or () if word in token)
+        else:
+            # Too short for trigrams; the vocabulary is small enough to scan
+            tokens.update(token for token in self.vocabulary if word in token)
+        return tokens
+
+    def compact(self):
+        """
+        Rewrites the log with only the live pages.
+        """
+        with self.lock:
+            partial = self.path + ".part"
+            with open(partial, "w") as f:
+                for page, tokens in self.pages.items():
+                    f.write(json.dumps({"page": page, "tokens": sorted(tokens)}) + "\n")
+            os.replace(partial, self.path)
+            self.offset = os.path.getsize(self.path)
+            self.dead_lines = 0
+
+
+class PageIndexer:
+    """
+    Background worker that OCRs saved pages and adds them to a SearchIndex.
+    Pages are queued right after they are saved; on_indexed(page) is called
+    from the worker thread once a page is searchable.
+
+    Needs the tesseract command; without it submit() does nothing (a message is
+    printed once).
+    """
+    def __init__(self, index, on_indexed=None, timeout=60):
+        self.index = index
+        self.on_indexed = on_indexed
+        self.timeout = timeout
+        self.enabled = ocr_available()
+        self.queue = queue.Queue()
+        if self.enabled:
+            threading.Thread(target=self.run, name="page-indexer", daemon=True).start()
+        else:
+            print("Tesseract not found, page search is disabled")
+
+    def submit(self, page, path):
+        if self.enabled and page not in self.index:
+            self.queue.put((page, path))
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def run(self):
+        while True:
+            page, path = self.queue.get()
+            if not os.path.exists(path):
+                continue # Deleted before we got to it
+            try:
+                self.index.add(page, run_ocr(path, self.timeout))
+                if self.on_indexed:
+                    self.on_indexed(page)
+            except Exception as e:
+                print(f"Indexing {path} failed: {e}")
@@ -8,12 +8,19 @@ const pageCountSpan = document.getElementById('page-count');
 const captureMobileBtn = document.getElementById('capture-mobile-btn');
 const compileBtn = document.getElementById('compile-btn');
 const flashOverlay = document.getElementById('flash-overlay');
-const filterBtns = document.querySelectorAll('.toggle-btn');
+const filterBtns = document.querySelectorAll('#filter-group .toggle-btn');
+const applyFilterBtn = document.getElementById('apply-filter-btn');
+const autoBtns = document.querySelectorAll('#auto-group .toggle-btn');
+const outlineCanvas = document.getElementById('outline-canvas');
+const overlayGuide = document.querySelector('.overlay-guide');
 
 let currentStream = null;
 let scannedImages = []; // List of filenames
 let currentFilter = 'bw';
 
+// Tags this tab's uploads so the server can clean them up as a group (/cleanup)
+const sessionId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
 // --- Camera Setup ---
 
 async function getCameras() {
@@ -99,6 +106,41 @@ filterBtns.forEach(btn => {
     });
 });
 
+// Switches every page in the gallery to the current Scan Mode in one request
+applyFilterBtn.addEventListener('click', async () => {
+    const items = [...gallery.querySelectorAll('.gallery-item')];
+    applyFilterBtn.disabled = true;
+    try {
+        const response = await fetch('/refilter', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
+            body: JSON.stringify({ scan_ids: items.map(div => div.dataset.scanId), filter: currentFilter })
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            showToast("Error: " + result.error, "error");
+            return;
+        }
+
+        let expired = 0;
+        items.forEach((div, i) => {
+            if (result.results[i].error) {
+                expired++;
+            } else {
+                showFilter(div, result.results[i]);
+            }
+        });
+        if (expired) {
+            showToast(`${expired} page(s) expired, remove and rescan them`, "error");
+        }
+    } catch (err) {
+        console.error(err);
+        showToast("Failed to change filter", "error");
+    } finally {
+        applyFilterBtn.disabled = scannedImages.length === 0;
+    }
+});
+
 // --- Capture & Process ---
 
 captureBtn.addEventListener('click', async () => {
@@ -116,21 +158,18 @@ captureBtn.addEventListener('click', async () => {
     canvas.height = video.videoHeight;
     ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
 
-    const base64Image = canvas.toDataURL('image/jpeg', 0.9);
-
     // Show loading state on button
     const originalText = captureBtn.innerHTML;
     captureBtn.innerHTML = '<ion-icon name="hourglass"></ion-icon> Processing...';
     captureBtn.disabled = true;
 
     try {
-        const response = await fetch('/process', {
+        // Upload the JPEG bytes directly (no base64 data URL)
+        const blob = await canvasToBlob(canvas, 'image/jpeg', 0.9);
+        const response = await fetch(`/process?filter=${encodeURIComponent(currentFilter)}`, {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                image: base64Image,
-                filter: currentFilter
-            })
+            headers: { 'Content-Type': 'image/jpeg', 'X-Session-Id': sessionId },
+            body: blob
         });
 
         const result = await response.json();
@@ -154,10 +193,24 @@ captureBtn.addEventListener('click', async () => {
     }
 });
 
+function canvasToBlob(canvas, type, quality) {
+    return new Promise((resolve, reject) => {
+        canvas.toBlob(blob => {
+            if (blob) {
+                resolve(blob);
+            } else {
+                reject(new Error("Could not encode frame"));
+            }
+        }, type, quality);
+    });
+}
+
 captureMobileBtn.addEventListener('click', () => {
     captureBtn.click();
 });
 
+const FILTER_LABELS = { bw: 'B&W', gray: 'Gray', original: 'Color' };
+
 function addScanToGallery(scanData) {
     scannedImages.push(scanData.filename);
     updateStats();
@@ -165,13 +218,27 @@ function addScanToGallery(scanData) {
     // Create thumbnail
     const div = document.createElement('div');
     div.className = 'gallery-item';
+    div.dataset.filename = scanData.filename;
+    div.dataset.scanId = scanData.scan_id;
     div.innerHTML = `
-        <img src="${scanData.url}" alt="Scan">
-        <button class="delete-btn" onclick="removeScan('${scanData.filename}', this)">
+        <img src="${scanData.thumb_url}" alt="Scan" loading="lazy">
+        <button class="delete-btn" onclick="removeScan(this)">
             <ion-icon name="trash"></ion-icon>
         </button>
+        <div class="filter-chips"></div>
     `;
 
+    // Filter chips: switch this page's filter without uploading it again
+    const chips = div.querySelector('.filter-chips');
+    for (const [filter, label] of Object.entries(FILTER_LABELS)) {
+        const chip = document.createElement('button');
+        chip.className = 'chip' + (filter === scanData.filter ? ' active' : '');
+        chip.dataset.filter = filter;
+        chip.innerText = label;
+        chip.addEventListener('click', () => refilterScan(div, filter));
+        chips.appendChild(chip);
+    }
+
     // Insert before empty state (or hide empty state)
     if (scannedImages.length === 1) {
         emptyState.style.display = 'none';
@@ -180,9 +247,44 @@ function addScanToGallery(scanData) {
     gallery.insertBefore(div, gallery.firstChild);
 }
 
-window.removeScan = function (filename, btnElement) {
-    scannedImages = scannedImages.filter(f => f !== filename);
-    btnElement.parentElement.remove();
+async function refilterScan(div, filter) {
+    try {
+        const response = await fetch('/refilter', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
+            body: JSON.stringify({ scan_id: div.dataset.scanId, filter: filter })
+        });
+        const result = await response.json();
+
+        if (!response.ok) {
+            alert('Error: ' + result.error);
+            return;
+        }
+
+        showFilter(div, result);
+    } catch (err) {
+        console.error(err);
+        alert('Failed to change filter');
+    }
+}
+
+function showFilter(div, result) {
+    // Same position in the document, new file
+    const index = scannedImages.indexOf(div.dataset.filename);
+    if (index !== -1) {
+        scannedImages[index] = result.filename;
+    }
+    div.dataset.filename = result.filename;
+    div.querySelector('img').src = result.thumb_url;
+    div.querySelectorAll('.chip').forEach(chip => {
+        chip.classList.toggle('active', chip.dataset.filter === result.filter);
+    });
+}
+
+window.removeScan = function (btnElement) {
+    const div = btnElement.parentElement;
+    scannedImages = scannedImages.filter(f => f !== div.dataset.filename);
+    div.remove();
     updateStats();
 
     if (scannedImages.length === 0) {
@@ -193,6 +295,7 @@ window.removeScan = function (filename, btnElement) {
 function updateStats() {
     pageCountSpan.innerText = scannedImages.length;
     compileBtn.disabled = scannedImages.length === 0;
+    applyFilterBtn.disabled = scannedImages.length === 0;
 }
 
 // --- Compile PDF ---
@@ -204,15 +307,24 @@ compileBtn.addEventListener('click', async () => {
     try {
         const response = await fetch('/compile', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
             body: JSON.stringify({ filenames: scannedImages })
         });
 
         const result = await response.json();
 
         if (result.success) {
-            window.location.href = result.download_url;
-            showToast("PDF Downloaded!", "success");
+            // Compilation runs as a background job; poll until the PDF is ready
+            const job = await waitForJob(result.status_url);
+            if (job.status === 'done') {
+                window.location.href = job.download_url;
+                showToast("PDF Downloaded!", "success");
+            } else {
+                showToast("Compilation error: " + job.error, "error");
+            }
+        } else if (result.missing) {
+            // Pages deleted on the server (expired): say so rather than leave them out
+            showToast(`Compilation error: ${result.missing.length} page(s) expired, remove and rescan them`, "error");
         } else {
             showToast("Compilation error", "error");
         }
@@ -224,6 +336,214 @@ compileBtn.addEventListener('click', async () => {
     }
 });
 
+const JOB_TIMEOUT = 10 * 60 * 1000; // ms before giving up on a compile job
+
+async function waitForJob(statusUrl) {
+    const deadline = Date.now() + JOB_TIMEOUT;
+    while (Date.now() < deadline) {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        if (!job.success) {
+            throw new Error(job.error);
+        }
+        if (job.status === 'done' || job.status === 'error') {
+            return job;
+        }
+        compileBtn.innerHTML = `<ion-icon name="sync"></ion-icon> Compiling ${job.done}/${job.total}...`;
+        await new Promise(resolve => setTimeout(resolve, 500));
+    }
+    return { status: 'error', error: "timed out" };
+}
+
+// --- Live Outline & Auto Capture ---
+// Small preview frames go to the server a few times per second (WebSocket when the
+// async server runs, POST /detect otherwise); the answer is the document quad.
+
+const OUTLINE_WIDTH = 320; // Preview frame width in px (~10-30 KB as JPEG)
+const OUTLINE_QUALITY = 0.6;
+const OUTLINE_INTERVAL = 250; // ms between preview frames
+const OUTLINE_TIMEOUT = 2000; // ms to wait for a socket answer before using POST /detect
+const STABLE_MOTION = 0.01; // Max corner movement between previews (fraction of the frame)
+const STABLE_FRAMES = 6; // Previews held still before auto-capture (~1.5 s)
+const NEW_PAGE_MOTION = 0.05; // Movement that counts as a new page after a capture
+
+const previewCanvas = document.createElement('canvas');
+let autoCapture = true;
+let useSocket = 'WebSocket' in window;
+let outlineSocket = null;
+let lastQuad = null;
+let capturedQuad = null; // Quad of the last auto-capture, until the page changes
+let stableCount = 0;
+
+autoBtns.forEach(btn => {
+    btn.addEventListener('click', () => {
+        autoBtns.forEach(b => b.classList.remove('active'));
+        btn.classList.add('active');
+        autoCapture = btn.dataset.auto === 'on';
+        stableCount = 0;
+    });
+});
+
+function grabPreview() {
+    previewCanvas.width = OUTLINE_WIDTH;
+    previewCanvas.height = Math.round(video.videoHeight * OUTLINE_WIDTH / video.videoWidth);
+    previewCanvas.getContext('2d').drawImage(video, 0, 0, previewCanvas.width, previewCanvas.height);
+    return canvasToBlob(previewCanvas, 'image/jpeg', OUTLINE_QUALITY);
+}
+
+function openOutlineSocket() {
+    return new Promise((resolve, reject) => {
+        const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+        const socket = new WebSocket(`${protocol}://${location.host}/ws/outline`);
+        socket.binaryType = 'arraybuffer';
+        socket.onopen = () => resolve(socket);
+        socket.onerror = () => reject(new Error('Outline socket unavailable'));
+        // Closed between frames (server restart, proxy idle timeout): open a new one next time
+        socket.addEventListener('close', () => {
+            if (outlineSocket === socket) {
+                outlineSocket = null;
+            }
+        });
+    });
+}
+
+function socketRequest(socket, blob) {
+    // One frame in flight at a time, so the next message is this frame's answer
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(() => {
+            reject(new Error('Outline socket timed out'));
+            socket.close();
+        }, OUTLINE_TIMEOUT);
+        socket.onmessage = event => {
+            clearTimeout(timer);
+            resolve(JSON.parse(event.data));
+        };
+        socket.onclose = () => {
+            clearTimeout(timer);
+            reject(new Error('Outline socket closed'));
+        };
+        socket.send(blob);
+    });
+}
+
+async function detectOutline(blob) {
+    if (useSocket) {
+        let socket = outlineSocket;
+        try {
+            if (!socket || socket.readyState !== WebSocket.OPEN) {
+                socket = outlineSocket = await openOutlineSocket();
+            }
+        } catch (err) {
+            // Plain Flask server (no /ws/outline): use HTTP from now on
+            console.warn(err);
+            useSocket = false;
+            outlineSocket = null;
+        }
+        if (useSocket) {
+            try {
+                return await socketRequest(socket, blob);
+            } catch (err) {
+                // Lost or stalled socket: answer this frame over HTTP, reconnect on the next
+                console.warn(err);
+                outlineSocket = null;
+            }
+        }
+    }
+    const response = await fetch('/detect', {
+        method: 'POST',
+        headers: { 'Content-Type': 'image/jpeg' },
+        body: blob
+    });
+    return response.json();
+}
+
+function quadMotion(a, b) {
+    let motion = 0;
+    for (let i = 0; i < 4; i++) {
+        motion = Math.max(motion, Math.abs(a[i][0] - b[i][0]), Math.abs(a[i][1] - b[i][1]));
+    }
+    return motion;
+}
+
+function handleOutline(result) {
+    const quad = result.detected ? result.quad : null;
+    if (quad && lastQuad && quadMotion(quad, lastQuad) < STABLE_MOTION) {
+        stableCount++;
+    } else {
+        stableCount = 0;
+    }
+    lastQuad = quad;
+
+    // After an auto-capture, wait for the page to go away or move before the next one
+    if (capturedQuad && (!quad || quadMotion(quad, capturedQuad) > NEW_PAGE_MOTION)) {
+        capturedQuad = null;
+    }
+
+    const armed = autoCapture && !capturedQuad;
+    drawOutline(quad, armed ? Math.min(1, stableCount / STABLE_FRAMES) : 0);
+
+    if (armed && quad && stableCount >= STABLE_FRAMES && !captureBtn.disabled) {
+        capturedQuad = quad;
+        stableCount = 0;
+        captureBtn.click();
+    }
+}
+
+function drawOutline(quad, progress) {
+    const width = outlineCanvas.clientWidth;
+    const height = outlineCanvas.clientHeight;
+    if (outlineCanvas.width !== width || outlineCanvas.height !== height) {
+        outlineCanvas.width = width;
+        outlineCanvas.height = height;
+    }
+    const ctx = outlineCanvas.getContext('2d');
+    ctx.clearRect(0, 0, width, height);
+    overlayGuide.classList.toggle('tracking', !!quad);
+    if (!quad) {
+        return;
+    }
+
+    // The video is shown with object-fit: cover, so apply the same scale and crop
+    const scale = Math.max(width / video.videoWidth, height / video.videoHeight);
+    const offsetX = (width - video.videoWidth * scale) / 2;
+    const offsetY = (height - video.videoHeight * scale) / 2;
+
+    ctx.beginPath();
+    quad.forEach(([x, y], i) => {
+        const px = offsetX + x * video.videoWidth * scale;
+        const py = offsetY + y * video.videoHeight * scale;
+        if (i === 0) {
+            ctx.moveTo(px, py);
+        } else {
+            ctx.lineTo(px, py);
+        }
+    });
+    ctx.closePath();
+    // Fills up while the page is held still
+    ctx.fillStyle = `rgba(16, 185, 129, ${0.1 + 0.3 * progress})`;
+    ctx.fill();
+    ctx.lineWidth = 3;
+    ctx.strokeStyle = '#10b981';
+    ctx.stroke();
+}
+
+async function outlineLoop() {
+    while (true) {
+        const started = Date.now();
+        if (!document.hidden && video.videoWidth) {
+            try {
+                handleOutline(await detectOutline(await grabPreview()));
+            } catch (err) {
+                console.error(err);
+            }
+        }
+        // Back off when the server is slow (e.g. busy with captures): wait at least as
+        // long as the last answer took, so previews use at most half of its time
+        const elapsed = Date.now() - started;
+        await new Promise(resolve => setTimeout(resolve, Math.max(OUTLINE_INTERVAL - elapsed, elapsed)));
+    }
+}
+
 // --- Toast Notification Helper ---
 function showToast(message, type = 'info') {
     const toast = document.createElement('div');
@@ -252,3 +572,4 @@ function showToast(message, type = 'info') {
 
 // Init
 getCameras();
+outlineLoop();
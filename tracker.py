@@ -0,0 +1,114 @@
+import cv2
+import numpy as np
+
+
+class QuadTracker:
+    """
+    Follows the four document corners from frame to frame with pyramidal
+    Lucas-Kanade optical flow, so the full blur/Canny/contour search only runs
+    every redetect_interval frames or when tracking confidence drops.
+
+    Tracking runs on the same downscaled grayscale image the scanner uses for
+    detection. Contours are returned in full resolution coordinates, ordered
+    top-left, top-right, bottom-right, bottom-left.
+    """
+    def __init__(self, scanner, redetect_interval=10, max_error=20.0, smoothing=0.6):
+        self.scanner = scanner
+        self.redetect_interval = redetect_interval
+        self.max_error = max_error # Largest LK residual accepted for a corner
+        self.smoothing = smoothing # Weight of the previous value in the motion average
+
+        self.lk_params = dict(winSize=(21, 21), maxLevel=3,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+        # Counters, e.g. for the status bar
+        self.detections = 0
+        self.tracked_frames = 0
+
+        self.reset()
+
+    def reset(self):
+        self.corners = None # float32 (4, 1, 2), downscaled coordinates
+        self.prev_small = None
+        self.reference_area = None
+        self.frames_since_detect = 0
+        self.motion = None
+        self.tracked = False
+
+    def update(self, frame):
+        """
+        Returns the document contour for this frame (or None).
+        After the call, motion holds the smoothed corner movement per frame as a
+        fraction of the frame diagonal (None until two frames agree on a quad).
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        scale = self.scanner.detection_scale(gray.shape)
+        small = gray
+        if scale < 1.0:
+            small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        corners = None
+        if self.corners is not None and self.frames_since_detect < self.redetect_interval:
+            corners = self.track(small)
+
+        self.tracked = corners is not None
+        if self.tracked:
+            self.tracked_frames += 1
+            self.frames_since_detect += 1
+        else:
+            corners = self.detect(small)
+
+        if corners is None:
+            self.reset()
+            return None
+
+        # Corners keep their order, so motion is the mean displacement per corner
+        if self.corners is not None:
+            displacement = np.linalg.norm(corners - self.corners, axis=2).mean()
+            diagonal = np.hypot(small.shape[0], small.shape[1])
+            self.update_motion(displacement / diagonal)
+
+        self.corners = corners
+        self.prev_small = small
+
+        contour = corners / scale
+        if self.scanner.refine_corners and scale < 1.0:
+            contour = self.scanner.refine_quad(gray, contour, scale)
+        return contour
+
+    def detect(self, small):
+        doc_contour, _ = self.scanner.find_quad(small)
+        self.detections += 1
+        self.frames_since_detect = 0
+        if doc_contour is None:
+            return None
+
+        ordered = self.scanner.order_points(doc_contour.reshape(4, 2).astype("float32"))
+        self.reference_area = cv2.contourArea(ordered)
+        return ordered.reshape(4, 1, 2)
+
+    def track(self, small):
+        """
+        Moves the corners to the new frame. Returns None when the result can't be
+        trusted: a corner was lost, the residual is high or the quad degenerated.
+        """
+        new_corners, status, error = cv2.calcOpticalFlowPyrLK(self.prev_small, small, self.corners, None, **self.lk_params)
+        if new_corners is None or not status.all() or error.max() > self.max_error:
+            return None
+
+        quad = new_corners.reshape(4, 2)
+        if not cv2.isContourConvex(quad):
+            return None
+
+        # Page can't shrink or grow this much between two frames
+        area = cv2.contourArea(quad)
+        if not 0.7 * self.reference_area < area < 1.4 * self.reference_area:
+            return None
+
+        return new_corners
+
+    def update_motion(self, value):
+        if self.motion is None:
+            self.motion = value
+        else:
+            self.motion = self.smoothing * self.motion + (1 - self.smoothing) * value
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+# Corners may move this many pixels (full resolution) before the maps are rebuilt
+LOCK_TOLERANCE = 3.0
+
+
+class WarpMapCache:
+    """
+    Precomputed remap tables for "locked geometry" scanning (camera on a fixed
+    stand, so every page sits in almost the same quad).
+
+    The first page of a quad pays for the homography and for mapping every
+    output pixel back into the frame; the result is converted to OpenCV's fixed
+    point format (convertMaps, CV_16SC2), which remap() reads fastest. Later
+    pages whose corners are all within tolerance pixels of a cached quad reuse
+    its maps and output size, so a warp is a lookup plus one remap.
+
+    Corners are snapped to a grid of tolerance pixels before the homography is
+    computed, so jitter around one position always yields the same maps. A few
+    quads are kept (least recently used dropped first) for stations that
+    switch between page formats.
+    """
+    def __init__(self, page_size, tolerance=LOCK_TOLERANCE, max_entries=4):
+        self.page_size = page_size # Output (width, height) for a quad
+        self.tolerance = tolerance
+        self.max_entries = max_entries
+        self.entries = OrderedDict() # Key -> (rect, size, map1, map2)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, rect, frame_shape, size=None):
+        """
+        Maps for an ordered quad (see DocumentScanner.order_points) in a frame of
+        frame_shape. size: (width, height) of the output, or None to keep the
+        cached one (or derive it from the quad). Returns (map1, map2, size).
+        """
+        with self.lock:
+            for key, (cached, cached_size, map1, map2) in self.entries.items():
+                if key[0] != frame_shape[:2] or (size is not None and cached_size != size):
+                    continue
+                if np.abs(cached - rect).max() <= self.tolerance:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return map1, map2, cached_size
+
+        # Miss: build outside the lock (another worker may do the same; harmless)
+        snapped = (np.round(rect / self.tolerance) * self.tolerance).astype(np.float32)
+        if size is None:
+            size = self.page_size(snapped)
+        map1, map2 = build_maps(snapped, size)
+        key = (frame_shape[:2], size, snapped.tobytes())
+        with self.lock:
+            self.misses += 1
+            self.entries[key] = (snapped, size, map1, map2)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return map1, map2, size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def build_maps(rect, size):
+    """
+    Fixed point remap tables sending each pixel of a (width, height) page to its
+    source position inside the quad.
+    """
+    width, height = size
+    dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype="float32")
+    # Output -> frame, i.e. the inverse of the warpPerspective matrix
+    inverse = cv2.getPerspectiveTransform(dst, rect)
+
+    xs = np.arange(width, dtype=np.float32)
+    ys = np.arange(height, dtype=np.float32)[:, None]
+    (a, b, c), (d, e, f), (g, h, i) = inverse.astype(np.float32)
+    w = g * xs + h * ys + i
+    map_x = (a * xs + b * ys + c) / w
+    map_y = (d * xs + e * ys + f) / w
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)